@@ -0,0 +1,395 @@
+import os
+import json
+import time
+import random
+import threading
+import http.server
+import urllib.error
+import urllib.request
+import concurrent.futures
+
+from traitlets.config import Configurable
+from traitlets import Bool, Float, Integer, Unicode, default
+
+from .utils import JhubctlError
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a sorted list of values."""
+    if len(values) == 0:
+        return None
+    rank = max(1, -(-len(values) * p // 100))
+    return values[int(rank) - 1]
+
+
+class HubApi(object):
+    """Minimal client of the JupyterHub REST API."""
+    def __init__(self, url, token, timeout=30.0):
+        self.url = url.rstrip('/') + '/hub/api'
+        self.token = token
+        self.timeout = timeout
+
+    def request(self, method, path, data=None):
+        """Send a request, returning the status and decoded body."""
+        body = None if data is None else json.dumps(data).encode('utf-8')
+        request = urllib.request.Request(
+            self.url + path,
+            data=body,
+            method=method,
+            headers={
+                'Authorization': f'token {self.token}',
+                'Content-Type': 'application/json'
+            }
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                status, text = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, text = e.code, e.read()
+        data = json.loads(text) if text else None
+        return status, data
+
+    def create_users(self, names):
+        status, data = self.request('POST', '/users', {'usernames': names})
+        # 409: every user already exists.
+        if status not in (201, 409):
+            raise JhubctlError(f"Could not create users ({status}): {data}")
+
+    def get_user(self, name):
+        status, data = self.request('GET', f'/users/{name}')
+        if status != 200:
+            raise JhubctlError(f"Could not get user {name} ({status}): {data}")
+        return data
+
+    def start_server(self, name):
+        status, data = self.request('POST', f'/users/{name}/server')
+        if status not in (201, 202):
+            message = (data or {}).get('message', data)
+            raise JhubctlError(f"Spawn request failed ({status}): {message}")
+
+    def stop_server(self, name):
+        status, data = self.request('DELETE', f'/users/{name}/server')
+        # 400: no server is running; 202: the server is stopping.
+        if status not in (202, 204, 400):
+            message = (data or {}).get('message', data)
+            raise JhubctlError(f"Stop request failed ({status}): {message}")
+
+    def delete_user(self, name):
+        status, data = self.request('DELETE', f'/users/{name}')
+        if status not in (204, 404):
+            message = (data or {}).get('message', data)
+            raise JhubctlError(f"Could not delete {name} ({status}): {message}")
+
+
+class FakeHubServer(http.server.ThreadingHTTPServer):
+    """HTTP server of a FakeHub, accepting a load test's worth of
+    simultaneous connections.
+    """
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class FakeHub(object):
+    """In-process stand-in for the JupyterHub REST API, for testing the
+    benchmark offline. Servers become ready after a random delay around
+    `spawn_time` seconds; a `failure_rate` fraction of spawns fail.
+    """
+    def __init__(self, token, spawn_time=2.0, failure_rate=0.0):
+        self.token = token
+        self.spawn_time = spawn_time
+        self.failure_rate = failure_rate
+        self.users = {}
+        self.lock = threading.Lock()
+        self.httpd = FakeHubServer(('127.0.0.1', 0), FakeHubHandler)
+        self.httpd.hub = self
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address
+        return f'http://{host}:{port}'
+
+    def start(self):
+        thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def get_user(self, name):
+        """User model, with the server ready once its spawn is done,
+        and gone once its stop is done.
+        """
+        user = self.users[name]
+        ready_at = user.get('ready_at')
+        if ready_at is not None and time.time() >= ready_at:
+            user['ready_at'] = None
+            user['pending'] = None
+            if not user.pop('fails'):
+                user['server'] = f'/user/{name}/'
+        stopped_at = user.get('stopped_at')
+        if stopped_at is not None and time.time() >= stopped_at:
+            user.update(server=None, pending=None, stopped_at=None)
+        return {
+            'name': name,
+            'server': user['server'],
+            'pending': user['pending'],
+        }
+
+    def route(self, method, path, data):
+        parts = [p for p in path.split('/') if p]
+        if parts[:2] != ['hub', 'api']:
+            return 404, {'message': 'Not found'}
+        parts = parts[2:]
+        with self.lock:
+            if parts == ['users'] and method == 'POST':
+                names = [n for n in data['usernames'] if n not in self.users]
+                if len(names) == 0:
+                    return 409, {'message': 'All users already exist'}
+                for name in names:
+                    self.users[name] = {'server': None, 'pending': None}
+                return 201, [{'name': name} for name in names]
+            if len(parts) < 2 or parts[0] != 'users' or parts[1] not in self.users:
+                return 404, {'message': 'No such user'}
+            name = parts[1]
+            if len(parts) == 2 and method == 'GET':
+                return 200, self.get_user(name)
+            if len(parts) == 2 and method == 'DELETE':
+                user = self.get_user(name)
+                if user['server'] or user['pending']:
+                    return 400, {'message': f'{name} has a server or pending action'}
+                del self.users[name]
+                return 204, None
+            if parts[2:] == ['server'] and method == 'POST':
+                user = self.get_user(name)
+                if user['server'] or user['pending']:
+                    return 400, {'message': f'{name} is already running'}
+                self.users[name].update(
+                    pending='spawn',
+                    ready_at=time.time() + random.uniform(0.5, 1.5) * self.spawn_time,
+                    fails=random.random() < self.failure_rate
+                )
+                return 202, None
+            if parts[2:] == ['server'] and method == 'DELETE':
+                user = self.get_user(name)
+                if not user['server']:
+                    return 400, {'message': f'{name} is not running'}
+                if user['pending'] is None:
+                    self.users[name].update(
+                        pending='stop',
+                        stopped_at=time.time() + random.uniform(0.05, 0.2) * self.spawn_time
+                    )
+                return 202, None
+        return 404, {'message': 'Not found'}
+
+
+class FakeHubHandler(http.server.BaseHTTPRequestHandler):
+    """Routes requests to the FakeHub serving them."""
+    def _handle(self, method):
+        hub = self.server.hub
+        if self.headers.get('Authorization') != f'token {hub.token}':
+            status, data = 403, {'message': 'Forbidden'}
+        else:
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length) if length else b''
+            data = json.loads(body) if body else None
+            status, data = hub.route(method, self.path, data)
+        body = b'' if data is None else json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HubBench(Configurable):
+    """Spawn-latency load test of a deployed hub.
+
+    Creates test users through the JupyterHub REST API, starts their
+    servers at once and reports how long the spawns took.
+    """
+    users = Integer(
+        10,
+        help="Number of test users to spawn servers for."
+    ).tag(config=True)
+
+    concurrency = Integer(
+        50,
+        help="Number of spawns requested at the same time."
+    ).tag(config=True)
+
+    user_prefix = Unicode(
+        u'jhubctl-bench-',
+        help="Prefix of the test users' names."
+    ).tag(config=True)
+
+    api_token = Unicode(
+        help="Admin API token of the hub. Defaults to $JUPYTERHUB_API_TOKEN."
+    ).tag(config=True)
+
+    @default('api_token')
+    def _default_api_token(self):
+        return os.environ.get('JUPYTERHUB_API_TOKEN', '')
+
+    url = Unicode(
+        help="Url of the hub. Defaults to the hub's load balancer."
+    ).tag(config=True)
+
+    spawn_timeout = Float(
+        600.0,
+        help="Seconds a spawn may take before it counts as failed."
+    ).tag(config=True)
+
+    poll_interval = Float(
+        1.0,
+        help="Seconds between checks of a pending spawn."
+    ).tag(config=True)
+
+    cleanup = Bool(
+        True,
+        help="Stop the test servers and delete the test users afterwards."
+    ).tag(config=True)
+
+    fake = Bool(
+        False,
+        help="Benchmark a built-in fake hub instead of a deployed one."
+    ).tag(config=True)
+
+    fake_spawn_time = Float(
+        2.0,
+        help="Average spawn time (seconds) of the fake hub."
+    ).tag(config=True)
+
+    fake_failure_rate = Float(
+        0.0,
+        help="Fraction of the fake hub's spawns that fail."
+    ).tag(config=True)
+
+    def spawn(self, api, name):
+        """Start a user's server and wait until it is ready.
+
+        Returns the spawn time in seconds.
+        """
+        start = time.time()
+        api.start_server(name)
+        while time.time() - start < self.spawn_timeout:
+            user = api.get_user(name)
+            if user['server'] and not user['pending']:
+                return time.time() - start
+            if not user['server'] and not user['pending']:
+                raise JhubctlError("Spawn failed")
+            time.sleep(self.poll_interval)
+        raise JhubctlError(f"Timed out after {self.spawn_timeout:.0f}s")
+
+    def remove_user(self, api, name):
+        """Stop a test user's server, wait until it has stopped (or its
+        spawn has ended), then delete the user.
+        """
+        start = time.time()
+        while True:
+            user = api.get_user(name)
+            if not user['server'] and not user['pending']:
+                break
+            if time.time() - start >= self.spawn_timeout:
+                raise JhubctlError(
+                    f"{name}: server still {user['pending'] or 'running'} "
+                    f"after {self.spawn_timeout:.0f}s")
+            if user['server'] and not user['pending']:
+                api.stop_server(name)
+            time.sleep(self.poll_interval)
+        api.delete_user(name)
+
+    def cleanup_users(self, api, names):
+        """Remove the test users; return the failures by message."""
+        failures = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [executor.submit(self.remove_user, api, name) for name in names]
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    message = str(e)
+                    failures[message] = failures.get(message, 0) + 1
+        return failures
+
+    def run(self, url):
+        """Spawn servers for every test user; return the spawn times and
+        failures, the total duration, and the failures to clean up.
+        """
+        if self.api_token == '':
+            raise JhubctlError(
+                "An admin API token is required; set --HubBench.api_token "
+                "or JUPYTERHUB_API_TOKEN."
+            )
+        api = HubApi(url, self.api_token)
+        names = [f'{self.user_prefix}{i}' for i in range(self.users)]
+        api.create_users(names)
+        times, failures = [], {}
+        start = time.time()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = {executor.submit(self.spawn, api, name): name for name in names}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    times.append(future.result())
+                except Exception as e:
+                    message = str(e)
+                    failures[message] = failures.get(message, 0) + 1
+        duration = time.time() - start
+        cleanup_failures = {}
+        if self.cleanup:
+            cleanup_failures = self.cleanup_users(api, names)
+        return sorted(times), failures, duration, cleanup_failures
+
+    def print_report(self, times, failures, duration, cleanup_failures=None):
+        """Print spawn-time percentiles, failures and throughput."""
+        print(f"Spawned {len(times)}/{self.users} servers in {duration:.1f}s "
+              f"({len(times) / duration * 60:.1f} spawns/min)")
+        if len(times) > 0:
+            print("Spawn time:")
+            for p in (50, 90, 95, 99):
+                print(f"  p{p}: {percentile(times, p):.1f}s")
+            print(f"  max: {times[-1]:.1f}s")
+        if len(failures) > 0:
+            print("Failures:")
+            for message, count in sorted(failures.items(), key=lambda x: -x[1]):
+                print(f"  {count} x {message}")
+        if cleanup_failures:
+            print("Cleanup failures (test users left behind):")
+            for message, count in sorted(cleanup_failures.items(), key=lambda x: -x[1]):
+                print(f"  {count} x {message}")
+
+    def start(self, name, get_url):
+        """Benchmark the named hub; `get_url` looks up its url."""
+        fake_hub = None
+        if self.fake:
+            self.api_token = self.api_token or 'fake-token'
+            fake_hub = FakeHub(
+                self.api_token,
+                spawn_time=self.fake_spawn_time,
+                failure_rate=self.fake_failure_rate
+            )
+            fake_hub.start()
+            url = fake_hub.url
+        else:
+            url = self.url or get_url()
+        print(f"Benchmarking {name} at {url}: {self.users} users, "
+              f"{self.concurrency} concurrent spawns")
+        try:
+            times, failures, duration, cleanup_failures = self.run(url)
+        finally:
+            if fake_hub is not None:
+                fake_hub.stop()
+        self.print_report(times, failures, duration, cleanup_failures)
+        return len(failures) == 0 and len(cleanup_failures) == 0
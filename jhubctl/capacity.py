@@ -0,0 +1,309 @@
+import re
+import math
+
+from traitlets.config import Configurable
+from traitlets import Dict, Float, Integer, Unicode
+
+from .clusters import providers
+from .hubs import Hub
+from .utils import JhubctlError, NODE_POOL_LABEL
+
+
+# Powers of 1024 of memory suffixes. Like KubeSpawner, '1G' is read
+# as 1GiB.
+MEMORY_UNITS = {'': 0, 'K': 1, 'M': 2, 'G': 3, 'T': 4}
+
+# Slack for rounding errors when dividing resources.
+EPSILON = 1e-9
+
+
+def parse_memory(value):
+    """Bytes of a memory quantity such as 2147483648, '1G' or '512Mi'."""
+    match = re.fullmatch(r'\s*([0-9.]+)\s*([kKMGT]?)i?B?\s*', str(value))
+    if match is None:
+        raise JhubctlError(f"Cannot read memory quantity '{value}'.")
+    number, unit = match.groups()
+    return float(number) * 1024 ** MEMORY_UNITS[unit.upper()]
+
+
+def parse_cpu(value):
+    """Cores of a CPU quantity such as 0.5 or '500m'."""
+    text = str(value).strip()
+    try:
+        if text.endswith('m'):
+            return float(text[:-1]) / 1000
+        return float(text)
+    except ValueError:
+        raise JhubctlError(f"Cannot read CPU quantity '{value}'.")
+
+
+def format_resources(cpu, memory, pods=None):
+    """Format resources as e.g. '1.8 CPU, 2.9Gi, 15 pods'."""
+    text = f"{cpu:.2f} CPU, {memory / 2**30:.1f}Gi"
+    if pods is not None:
+        text += f", {pods} pods"
+    return text
+
+
+def fits(free, guarantee):
+    """Whether a server with these guarantees fits in `free` resources."""
+    return (
+        free['pods'] >= 1
+        and free['cpu'] + EPSILON >= guarantee['cpu']
+        and free['memory'] + EPSILON >= guarantee['memory']
+    )
+
+
+def get_users_per_node(free, guarantee):
+    """Number of servers fitting on an empty node, and the resource
+    that limits them.
+    """
+    limits = {'pods': free['pods']}
+    for resource in ('cpu', 'memory'):
+        if guarantee[resource] > 0:
+            limits[resource] = math.floor(free[resource] / guarantee[resource] + EPSILON)
+    resource = min(limits, key=limits.get)
+    return max(0, limits[resource]), resource
+
+
+class CapacityPlanner(Configurable):
+    """Offline estimate of the users a cluster can hold.
+
+    Node groups come from the provider's config and per-user guarantees
+    from each hub's config; nothing is looked up on the provider or the
+    cluster. A node group of several instance types is counted as if
+    every node were the smallest of them. The hub and proxy pods are
+    not counted.
+    """
+    hubs = Dict(
+        help="Hubs to plan for, mapping names to their config.yaml, e.g. "
+             "{'hub1': 'hub1.yaml'}. Defaults to the `Hub` config."
+    ).tag(config=True)
+
+    users = Integer(
+        0,
+        help="Target concurrent users of each hub. If given, plan the "
+             "nodes they need."
+    ).tag(config=True)
+
+    default_cpu_guarantee = Float(
+        0.0,
+        help="CPU guarantee (cores) of hubs whose config sets none."
+    ).tag(config=True)
+
+    default_memory_guarantee = Unicode(
+        u'1G',
+        help="Memory guarantee of hubs whose config sets none; the "
+             "chart's default."
+    ).tag(config=True)
+
+    node_overhead_cpu = Float(
+        0.125,
+        help="CPU (cores) requested on every node by daemonsets, "
+             "e.g. aws-node and kube-proxy."
+    ).tag(config=True)
+
+    node_overhead_memory = Unicode(
+        u'0',
+        help="Memory requested on every node by daemonsets."
+    ).tag(config=True)
+
+    node_overhead_pods = Integer(
+        2,
+        help="Number of daemonset pods on every node."
+    ).tag(config=True)
+
+    def get_hubs(self):
+        """Get Hub objects keyed by name."""
+        if len(self.hubs) == 0:
+            hub = Hub(namespace='', config=self.config)
+            return {hub.namespace or 'hub': hub}
+        hubs = {}
+        for name, config_file in self.hubs.items():
+            hub = Hub(namespace=name, config=self.config)
+            hub.config_file = config_file
+            hubs[name] = hub
+        return hubs
+
+    def get_guarantees(self, hub):
+        """Get the node pool and per-user guarantees of a hub's default
+        server and of each of its profiles.
+
+        Returns
+        -------
+        default : dict
+            `pool`, `cpu` (cores) and `memory` (bytes) of a server.
+        profiles : dict
+            Mapping of profile names to the same, for profiles that
+            override any of them.
+        """
+        singleuser = hub.get_singleuser_config()
+        cpu = (singleuser.get('cpu') or {}).get('guarantee')
+        memory = (singleuser.get('memory') or {}).get('guarantee')
+        node_selector = singleuser.get('nodeSelector') or {}
+        default = dict(
+            pool=node_selector.get(NODE_POOL_LABEL, ''),
+            cpu=parse_cpu(self.default_cpu_guarantee if cpu is None else cpu),
+            memory=parse_memory(self.default_memory_guarantee if memory is None else memory)
+        )
+        profiles = {}
+        for profile in singleuser.get('profileList') or []:
+            override = profile.get('kubespawner_override') or {}
+            keys = ('cpu_guarantee', 'mem_guarantee', 'node_selector')
+            if not any(key in override for key in keys):
+                continue
+            guarantee = dict(default)
+            if 'cpu_guarantee' in override:
+                guarantee['cpu'] = parse_cpu(override['cpu_guarantee'])
+            if 'mem_guarantee' in override:
+                guarantee['memory'] = parse_memory(override['mem_guarantee'])
+            if 'node_selector' in override:
+                guarantee['pool'] = override['node_selector'].get(NODE_POOL_LABEL, '')
+            profiles[profile.get('display_name', 'profile')] = guarantee
+        return default, profiles
+
+    def get_node_groups(self, cluster):
+        """Get the cluster's node groups, with the resources (`free`) left
+        for users on each node once daemonsets are scheduled.
+        """
+        groups = cluster.get_node_groups()
+        for group in groups:
+            allocatable = [cluster.get_allocatable(t) for t in group['instance_types']]
+            group['free'] = dict(
+                cpu=min(a['cpu'] for a in allocatable) - self.node_overhead_cpu,
+                memory=min(a['memory'] for a in allocatable) - parse_memory(self.node_overhead_memory),
+                pods=min(a['pods'] for a in allocatable) - self.node_overhead_pods
+            )
+        return groups
+
+    def get_eligible_groups(self, groups, pool):
+        """Indices of the groups a server of this node pool can run on."""
+        return [
+            index for index, group in enumerate(groups)
+            if pool == '' or group['pool'] == pool
+        ]
+
+    def get_max_users(self, groups, guarantee):
+        """Most users of a hub the cluster holds, if it were alone.
+
+        Returns
+        -------
+        users : int
+        per_node : list of tuple
+            For each group the hub runs on: the group, users per node,
+            the resource limiting them and the resources left over.
+        """
+        users = 0
+        per_node = []
+        for index in self.get_eligible_groups(groups, guarantee['pool']):
+            group = groups[index]
+            count, resource = get_users_per_node(group['free'], guarantee)
+            headroom = dict(
+                cpu=group['free']['cpu'] - count * guarantee['cpu'],
+                memory=group['free']['memory'] - count * guarantee['memory']
+            )
+            users += count * group['max_size']
+            per_node.append((group, count, resource, headroom))
+        return users, per_node
+
+    def pack(self, groups, guarantees):
+        """Place `users` servers of every hub on nodes, first-fit and
+        largest first. Nodes are added group by group, up to each group's
+        max size; the nodes of each group's min size always exist.
+
+        Returns
+        -------
+        nodes : list of dict
+            `group` index, `users` and `free` resources of each node.
+        unplaced : int
+            Number of servers that did not fit.
+        """
+        servers = [g for g in guarantees for _ in range(self.users)]
+        servers.sort(key=lambda g: (g['memory'], g['cpu']), reverse=True)
+        nodes = [
+            dict(group=index, users=0, free=dict(group['free']))
+            for index, group in enumerate(groups)
+            for _ in range(group['min_size'])
+        ]
+        unplaced = 0
+        for server in servers:
+            eligible = self.get_eligible_groups(groups, server['pool'])
+            node = next(
+                (n for n in nodes if n['group'] in eligible and fits(n['free'], server)),
+                None
+            )
+            if node is None:
+                for index in eligible:
+                    size = sum(1 for n in nodes if n['group'] == index)
+                    free = groups[index]['free']
+                    if size < groups[index]['max_size'] and fits(free, server):
+                        node = dict(group=index, users=0, free=dict(free))
+                        nodes.append(node)
+                        break
+            if node is None:
+                unplaced += 1
+                continue
+            node['users'] += 1
+            node['free']['cpu'] -= server['cpu']
+            node['free']['memory'] -= server['memory']
+            node['free']['pods'] -= 1
+        return nodes, unplaced
+
+    def print_node_groups(self, groups):
+        print("Node groups (per node, after system reservations and daemonsets):")
+        for group in groups:
+            on_demand = ''
+            if group['on_demand'] < group['max_size']:
+                on_demand = f", {group['on_demand']} on-demand"
+            print(f"  {group['pool']}: {', '.join(group['instance_types'])}, "
+                  f"{group['min_size']}-{group['max_size']} nodes{on_demand}; "
+                  f"{format_resources(**group['free'])}")
+
+    def print_max_users(self, groups, hubs):
+        print("Max concurrent users (each hub alone):")
+        for name, (default, profiles) in hubs.items():
+            rows = [(name, default)]
+            rows += [(f"{name} [{profile}]", g) for profile, g in profiles.items()]
+            for row_name, guarantee in rows:
+                users, per_node = self.get_max_users(groups, guarantee)
+                print(f"  {row_name}: {users} users; "
+                      f"{format_resources(guarantee['cpu'], guarantee['memory'])} each")
+                if len(per_node) == 0:
+                    print(f"    no node group in pool '{guarantee['pool']}'")
+                for group, count, resource, headroom in per_node:
+                    print(f"    {group['pool']}: {count} per node ({resource}-bound), "
+                          f"{format_resources(**headroom)} left per node")
+
+    def print_target(self, groups, hubs):
+        guarantees = [default for default, profiles in hubs.values()]
+        nodes, unplaced = self.pack(groups, guarantees)
+        print(f"Nodes for {self.users} concurrent users of each hub "
+              f"({self.users * len(hubs)} servers):")
+        for index, group in enumerate(groups):
+            used = [n for n in nodes if n['group'] == index]
+            if len(used) == 0:
+                print(f"  {group['pool']}: 0 of {group['max_size']} nodes")
+                continue
+            cpu = sum(group['free']['cpu'] for n in used)
+            memory = sum(group['free']['memory'] for n in used)
+            free_cpu = sum(n['free']['cpu'] for n in used)
+            free_memory = sum(n['free']['memory'] for n in used)
+            print(f"  {group['pool']}: {len(used)} of {group['max_size']} nodes, "
+                  f"{sum(n['users'] for n in used)} servers; unused "
+                  f"{free_cpu / cpu:.0%} of CPU, {free_memory / memory:.0%} of memory")
+        if unplaced > 0:
+            print(f"{unplaced} server(s) do not fit; raise the node groups' max size.")
+
+    def plan(self, name=None, provider='AwsEKS'):
+        """Print the capacity of the named cluster's configuration."""
+        Cluster = getattr(providers, provider)
+        cluster = Cluster(name=name or '', config=self.config)
+        groups = self.get_node_groups(cluster)
+        hubs = {
+            hub_name: self.get_guarantees(hub)
+            for hub_name, hub in self.get_hubs().items()
+        }
+        self.print_node_groups(groups)
+        self.print_max_users(groups, hubs)
+        if self.users > 0:
+            self.print_target(groups, hubs)
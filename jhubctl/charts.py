@@ -0,0 +1,153 @@
+import os
+import json
+import hashlib
+import pathlib
+import tempfile
+
+from traitlets.config import Configurable
+from traitlets import Unicode, default
+
+from .utils import JhubctlError
+from .helm import Helm
+
+
+# Chart version installed and cached when none is given.
+DEFAULT_CHART_VERSION = '0.7.0'
+
+
+def file_digest(path):
+    """sha256 of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ChartCache(Configurable):
+    """Local, content-addressed cache of Helm chart archives.
+
+    Archives are stored as `<sha256>.tgz` in `cache_dir`, and
+    `index.json` maps each (repo, chart, version) to its digest.
+    Charts are downloaded once with `helm fetch`; installs then
+    read the local archive, so they work without network access.
+    """
+    cache_dir = Unicode(
+        help="Directory holding cached chart archives."
+    ).tag(config=True)
+
+    @default('cache_dir')
+    def _default_cache_dir(self):
+        return str(pathlib.Path.home().joinpath('.jhubctl', 'charts'))
+
+    helm_repo = Unicode(
+        u'https://jupyterhub.github.io/helm-chart/',
+        help="Helm chart repository to fetch charts from."
+    ).tag(config=True)
+
+    chart = Unicode(
+        u'jupyterhub',
+        help="Name of the chart to cache."
+    ).tag(config=True)
+
+    version = Unicode(
+        help="Chart version cached when none is given. Defaults to "
+             "`Hub.version`, the version hubs install."
+    ).tag(config=True)
+
+    @default('version')
+    def _default_version(self):
+        return self.config.Hub.get('version', DEFAULT_CHART_VERSION)
+
+    @property
+    def index_path(self):
+        return pathlib.Path(self.cache_dir).joinpath('index.json')
+
+    def _key(self, version):
+        return f'{self.helm_repo}|{self.chart}|{version}'
+
+    def _read_index(self):
+        try:
+            return json.loads(self.index_path.read_text())
+        except FileNotFoundError:
+            return {}
+
+    def _write_index(self, index):
+        """Atomically replace the index."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix='.index.')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(index, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, str(self.index_path))
+
+    def lookup(self, version=None):
+        """Get the path of a cached chart archive, or None if the
+        archive is missing or corrupt.
+        """
+        version = version or self.version
+        digest = self._read_index().get(self._key(version))
+        if digest is None:
+            return None
+        path = pathlib.Path(self.cache_dir).joinpath(f'{digest}.tgz')
+        if not path.exists() or file_digest(path) != digest:
+            return None
+        return path
+
+    def fetch(self, version=None):
+        """Download a chart archive into the cache."""
+        version = version or self.version
+        pathlib.Path(self.cache_dir).mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=self.cache_dir) as tmp_dir:
+            out = Helm(config=self.config).fetch(
+                self.chart,
+                repo=self.helm_repo,
+                version=version,
+                destination=tmp_dir
+            )
+            if out.returncode != 0:
+                raise JhubctlError(out.stderr)
+            archives = list(pathlib.Path(tmp_dir).glob('*.tgz'))
+            if len(archives) != 1:
+                raise JhubctlError(
+                    f"Expected one chart archive from helm, got {len(archives)}.")
+            digest = file_digest(archives[0])
+            path = pathlib.Path(self.cache_dir).joinpath(f'{digest}.tgz')
+            os.replace(str(archives[0]), str(path))
+        index = self._read_index()
+        index[self._key(version)] = digest
+        self._write_index(index)
+        return path
+
+    def get_path(self, version=None):
+        """Get the path of a chart archive, fetching it if needed."""
+        path = self.lookup(version)
+        if path is None:
+            path = self.fetch(version)
+        return path
+
+    def cache(self, version=None):
+        """Warm the cache with a chart version."""
+        path = self.get_path(version)
+        print(f"Cached {self.chart}-{version or self.version}: {path}")
+
+    def get(self, version=None):
+        """Print the cached charts."""
+        print("Cached Charts:")
+        for key, digest in sorted(self._read_index().items()):
+            repo, chart, chart_version = key.split('|')
+            if version is not None and chart_version != version:
+                continue
+            print(f"  - {chart}-{chart_version} ({repo})")
+            print(f"    sha256: {digest}")
+
+    def delete(self, version):
+        """Remove a chart version from the cache."""
+        index = self._read_index()
+        digest = index.pop(self._key(version), None)
+        if digest is None:
+            raise JhubctlError(f"{self.chart}-{version} is not cached.")
+        self._write_index(index)
+        # Other entries may share the same content.
+        if digest not in index.values():
+            path = pathlib.Path(self.cache_dir).joinpath(f'{digest}.tgz')
+            if path.exists():
+                path.unlink()
@@ -3,11 +3,13 @@ import pathlib
 from traitlets.config import Configurable
 from traitlets import (
     Unicode,
+    Bool,
     Dict,
     default
 )
 
-from jhubctl.utils import SubclassError
+from jhubctl.utils import kubectl, SubclassError, JhubctlError
+from jhubctl.plan import Plan
 
 
 class Cluster(Configurable):
@@ -38,6 +40,11 @@ class Cluster(Configurable):
         help='User SSH key name'
     ).tag(config=True)
 
+    preflight = Bool(
+        True,
+        help="Check the provider account before creating a cluster."
+    ).tag(config=True)
+
     @property
     def kube_user_data(self):
         """Extra data to pass to the kubectl user for this cluster.
@@ -49,6 +56,8 @@ class Cluster(Configurable):
     def __init__(self, name, **traits):
         self.name = name
         super().__init__(**traits)
+        # Records what create/delete would do in dry-run mode.
+        self.plan = Plan(config=self.config)
 
     def check_if_cluster_is_deployed(self):
         """Returns True if the cluster is deployed and available.
@@ -66,12 +75,72 @@ class Cluster(Configurable):
         """
         raise SubclassError("Must be implemented in a subclass.")
 
+    def get_preflight_checks(self):
+        """Get (description, callable) pairs checking that the cluster
+        can be created. See `jhubctl.preflight.run_checks`.
+        """
+        return []
+
+    def get_node_groups(self):
+        """Get the cluster's node groups, as dictionaries with `pool`,
+        `instance_types`, `min_size`, `max_size` and `on_demand` (number
+        of on-demand nodes at `max_size`) keys. Must not call the provider.
+        """
+        raise SubclassError("Must be implemented in a subclass.")
+
+    def get_allocatable(self, instance_type):
+        """Get the `cpu` (cores), `memory` (bytes) and `pods` a node of
+        this instance type offers to pods. Must not call the provider.
+        """
+        raise SubclassError("Must be implemented in a subclass.")
+
+    def get_stacks(self):
+        """Get the status of each resource stack making up the cluster.
+        """
+        raise SubclassError("Must be implemented in a subclass.")
+
     def get_auth_config(self):
         """Get yaml describing authorized users for the cluster.
         """
         raise SubclassError("Must be implemented in a subclass.")
 
+    def apply_auth_config(self, kube_args):
+        """Apply the auth config to the running cluster."""
+        out = kubectl('apply', input=self.get_auth_config(), **kube_args)
+        if out.returncode != 0:
+            raise JhubctlError(out.stderr)
+
+    def get_autoscaler_config(self):
+        """Get yaml deploying a cluster autoscaler, or an empty string
+        if the cluster does not autoscale.
+        """
+        return ''
+
+    def get_shared_storage_config(self):
+        """Get yaml deploying storage shared by all nodes, or an empty
+        string if the cluster has none.
+        """
+        return ''
+
     def get_storage_config(self):
         """Get yaml describing storage on cluster.
         """
         raise SubclassError("Must be implemented in a subclass.")
+
+    def get_storage_drivers(self):
+        """Get kustomizations installing the drivers that provision the
+        cluster's storage classes.
+        """
+        return []
+
+    def apply_storage_config(self, kube_args):
+        """Install the storage drivers, then apply the storage config to
+        the running cluster.
+        """
+        for driver in self.get_storage_drivers():
+            out = kubectl('apply', '-k', driver, **kube_args)
+            if out.returncode != 0:
+                raise JhubctlError(out.stderr)
+        out = kubectl('apply', input=self.get_storage_config(), **kube_args)
+        if out.returncode != 0:
+            raise JhubctlError(out.stderr)
@@ -1,6 +1,11 @@
+import time
 import pprint
 from . import providers
 from jhubctl.utils import kubectl, helm, JhubctlError
+from jhubctl.helm import Helm
+from jhubctl.store import format_age
+from jhubctl.preflight import check_all
+from jhubctl.watch import Watch, RowDisplay
 
 
 class ClusterList(object):
@@ -8,39 +13,155 @@ class ClusterList(object):
 
     This class manages your configuration for kubectl.
     """
-    def __init__(self, kubeconf, config):
+    def __init__(self, kubeconf, store, config):
         self.kubeconf = kubeconf
+        self.store = store
         self.config = config
 
     def check_cluster_exists(self, name):
         """Check if cluster exists. If it does not, raise exception."""
+        # Reuses the kubeconfig if it is already open.
         self.kubeconf.open()
-        clusters = self.kubeconf.get_clusters()
-        names = [c['name'] for c in clusters]
-        if name in names:
-            return True
-        return False
+        return self.kubeconf.cluster_exists(name)
+
+    def check_names_free(self, name):
+        """Check that kubeconfig has no context or user with this name."""
+        self.kubeconf.open()
+        try:
+            taken = [
+                kind for kind, exists in (
+                    ('context', self.kubeconf.context_exists(name)),
+                    ('user', self.kubeconf.user_exists(name))
+                ) if exists
+            ]
+        finally:
+            self.kubeconf.release()
+        if taken:
+            raise JhubctlError(
+                f"kubeconfig already has a {' and '.join(taken)} named '{name}'.")
 
     def get(self, name=None, provider='AwsEKS', print_output=True):
         """List all cluster.
         """
         # Create cluster object
         Cluster = getattr(providers, provider)
-        cluster = Cluster(name)
+        cluster = Cluster(name, config=self.config)
+
+        watch = Watch(config=self.config)
+        if watch.enabled:
+            try:
+                if name is None:
+                    self.watch_clusters(watch)
+                else:
+                    self.watch_stacks(cluster, provider, watch)
+            except KeyboardInterrupt:
+                pass
+            return
 
         self.kubeconf.open()
-        if name is None:
-            clusters = self.kubeconf.get_clusters()
-            print("Running Clusters:")
-            for cluster in clusters:
-                print(f"  - {cluster['name']}")
-        else:
+        try:
+            if name is None:
+                clusters = self.kubeconf.get_clusters()
+                print("Running Clusters:")
+                for cluster in clusters:
+                    print(f"  - {cluster['name']}")
+                return
+
             # Check that cluster exists.
-            if self.check_cluster_exists(name) is False:
+            if self.check_cluster_exists(cluster.cluster_name) is False:
                 raise JhubctlError("Cluster name not found in availabe clusters.")
 
-            cluster = self.kubeconf.get_cluster(name=cluster.cluster_name)
-            pprint.pprint(cluster, depth=4)
+            data = self.kubeconf.get_cluster(name=cluster.cluster_name)
+        finally:
+            # Nothing to write; release the kubeconfig lock.
+            self.kubeconf.release()
+
+        pprint.pprint(data, depth=4)
+        self.print_stacks(
+            cluster,
+            provider=provider,
+            endpoint=data['cluster'].get('server')
+        )
+
+    def print_stacks(self, cluster, provider='AwsEKS', endpoint=None):
+        """Print the status of a cluster's stacks from the store.
+
+        The stacks are queried from the provider if they are not
+        stored yet or the store's `refresh` option is set. Stale
+        entries are refreshed in the background.
+        """
+        stacks = self.store.get_stacks(cluster.name)
+        if self.store.refresh or len(stacks) == 0:
+            self.store.put_cluster(
+                cluster.name,
+                cluster.cluster_name,
+                provider,
+                endpoint=endpoint,
+                stacks=cluster.get_stacks()
+            )
+            stacks = self.store.get_stacks(cluster.name)
+
+        updated = min(stack['updated'] for stack in stacks)
+        message = f"{format_age(time.time() - updated)} ago"
+        if self.store.is_stale(updated):
+            message += " (stale, refreshing)"
+            self.store.spawn_refresh(
+                'get',
+                'cluster',
+                cluster.name,
+                f'--kubeconfig={self.kubeconf.path}'
+            )
+        print(f"Stacks (updated {message}):")
+        for stack in stacks:
+            print(f"  - {stack['name']}: {stack['status']}")
+
+    def watch_clusters(self, watch):
+        """Print the clusters in kubeconfig, redrawing the list when
+        kubeconfig changes.
+        """
+        print("Running Clusters (Ctrl-C to stop):")
+        display = RowDisplay()
+        while True:
+            # Only re-parsed when the file changed.
+            self.kubeconf.open()
+            try:
+                names = [c['name'] for c in self.kubeconf.get_clusters()]
+            finally:
+                self.kubeconf.release()
+            for name in display.keys:
+                if name not in names:
+                    display.update(name, f"  - {name} (removed)")
+            for name in names:
+                display.update(name, f"  - {name}")
+            time.sleep(watch.poll_interval)
+
+    def watch_stacks(self, cluster, provider, watch):
+        """Print the status of a cluster's stacks, polling CloudFormation
+        every `poll_interval` seconds and redrawing the stacks that changed.
+        Statuses are written to the store, so `get` answers from them.
+        """
+        try:
+            if self.check_cluster_exists(cluster.cluster_name) is False:
+                raise JhubctlError("Cluster name not found in availabe clusters.")
+            data = self.kubeconf.get_cluster(name=cluster.cluster_name)
+        finally:
+            self.kubeconf.release()
+        print(f"Stacks of {cluster.name} (Ctrl-C to stop):")
+        display = RowDisplay()
+        for stack in self.store.get_stacks(cluster.name):
+            display.update(stack['name'], f"  - {stack['name']}: {stack['status']}")
+        while True:
+            stacks = cluster.get_stacks()
+            self.store.put_cluster(
+                cluster.name,
+                cluster.cluster_name,
+                provider,
+                endpoint=data['cluster'].get('server'),
+                stacks=stacks
+            )
+            for stack_name, status in stacks.items():
+                display.update(stack_name, f"  - {stack_name}: {status}")
+            time.sleep(watch.poll_interval)
 
     def create(self, name, provider='AwsEKS'):
         """Create a Kubernetes cluster on a given provider.
@@ -48,55 +169,155 @@ class ClusterList(object):
         # ----- Create K8s cluster on provider -------
         # Create cluster object
         Cluster = getattr(providers, provider)
-        cluster = Cluster(name=name, ssh_key_name='zsailer')
+        cluster = Cluster(name=name, config=self.config)
+
+        # Catch problems in seconds rather than midway through stacks.
+        if cluster.preflight and not cluster.plan.dry_run:
+            checks = [("Kubeconfig names", lambda: self.check_names_free(name))]
+            check_all(checks + cluster.get_preflight_checks())
+
         cluster.create()
 
+        if cluster.plan.dry_run:
+            self.plan_manifests(cluster)
+            cluster.plan.write()
+            cluster.plan.print_summary()
+            return
+
         # -------- Add cluster to kubeconf -----------
 
         # Add cluster to kubeconf
+        endpoint_url = cluster.endpoint_url
+        ca_cert = cluster.ca_cert
         self.kubeconf.open()
-        self.kubeconf.add_cluster(
-            cluster.cluster_name,
-            server=cluster.endpoint_url,
-            certificate_authority_data=cluster.ca_cert
-        )
+        try:
+            self.kubeconf.add_cluster(
+                cluster.cluster_name,
+                server=endpoint_url,
+                certificate_authority_data=ca_cert
+            )
 
-        # Add a user to kubeconf
-        self.kubeconf.add_user(name)
+            # Add a user to kubeconf
+            self.kubeconf.add_user(name)
 
-        # Add a user exec call for this provider.
-        self.kubeconf.add_to_user(
-            name,
-            **cluster.kube_user_data
-        )
+            # Add a user exec call for this provider.
+            self.kubeconf.add_to_user(
+                name,
+                **cluster.kube_user_data
+            )
+
+            # Add context mapping user to cluster.
+            self.kubeconf.add_context(
+                name,
+                cluster_name=cluster.cluster_name,
+                user_name=cluster.name
+            )
+        except Exception:
+            self.kubeconf.release()
+            raise
+
+        # Commit changes to file.
+        self.kubeconf.close()
 
-        # Add context mapping user to cluster.
-        self.kubeconf.add_context(
+        # Record the new cluster in the local state.
+        self.store.put_cluster(
             name,
-            cluster_name=cluster.cluster_name,
-            user_name=cluster.name
+            cluster.cluster_name,
+            provider,
+            endpoint=endpoint_url,
+            stacks=cluster.get_stacks()
         )
 
-        # Switch contexts.
-        self.kubeconf.set_current_context(name)
+        # Point every call below at the new cluster explicitly rather
+        # than switching the current-context in kubeconfig.
+        kube_args = dict(context=name, kubeconfig=self.kubeconf.path)
 
-        # Commit changes to file.
-        self.kubeconf.close()
-        
         # ------ Setup autorization -------
-        kubectl('apply', input=cluster.get_auth_config())
+        cluster.apply_auth_config(kube_args)
 
         # -------- Setup Storage ----------
-        kubectl('delete', 'storageclass', 'gp2')        
-        kubectl('apply', input=cluster.get_storage_config())
+        cluster.apply_storage_config(kube_args)
+
+        shared_storage_config = cluster.get_shared_storage_config()
+        if shared_storage_config != '':
+            out = kubectl('apply', input=shared_storage_config, **kube_args)
+            if out.returncode != 0:
+                raise JhubctlError(out.stderr)
 
+        # ------- Setup Autoscaling -------
+        autoscaler_config = cluster.get_autoscaler_config()
+        if autoscaler_config != '':
+            out = kubectl('apply', input=autoscaler_config, **kube_args)
+            if out.returncode != 0:
+                raise JhubctlError(out.stderr)
+
+        # Helm 3 needs no Tiller in the cluster.
+        if Helm(config=self.config).needs_tiller:
+            self.install_tiller(kube_args)
+
+    def plan_manifests(self, cluster):
+        """Add the manifests applied to a new cluster to its plan."""
+        plan = cluster.plan
+        plan.add_step(
+            'aws-auth',
+            'kubectl apply',
+            files={'aws-auth.yaml': cluster.get_auth_config()},
+            depends_on=[cluster.cluster_name],
+            estimate=10
+        )
+        storage_depends_on = [cluster.cluster_name]
+        storage_drivers = cluster.get_storage_drivers()
+        if len(storage_drivers) > 0:
+            plan.add_step(
+                'storage-drivers',
+                ' && '.join(f'kubectl apply -k {driver}' for driver in storage_drivers),
+                depends_on=['aws-auth'],
+                estimate=60
+            )
+            storage_depends_on = ['storage-drivers']
+        plan.add_step(
+            'storage-class',
+            'kubectl apply',
+            files={'storage-class.yaml': cluster.get_storage_config()},
+            depends_on=storage_depends_on,
+            estimate=10
+        )
+        shared_storage_config = cluster.get_shared_storage_config()
+        if shared_storage_config != '':
+            plan.add_step(
+                'shared-storage',
+                'kubectl apply',
+                files={'shared-storage.yaml': shared_storage_config},
+                depends_on=['aws-auth'],
+                estimate=30
+            )
+        autoscaler_config = cluster.get_autoscaler_config()
+        if autoscaler_config != '':
+            plan.add_step(
+                'cluster-autoscaler',
+                'kubectl apply',
+                files={'cluster-autoscaler.yaml': autoscaler_config},
+                depends_on=['aws-auth'],
+                estimate=30
+            )
+        if Helm(config=self.config).needs_tiller:
+            plan.add_step(
+                'tiller',
+                'helm init with a tiller service account',
+                depends_on=['aws-auth'],
+                estimate=60
+            )
+
+    def install_tiller(self, kube_args):
+        """Install and secure Tiller, the Helm 2 server, in a cluster."""
         # ------- setup helm locally ------
         kubectl(
             '--namespace',
             'kube-system',
             'create',
             'serviceaccount',
-            'tiller'
+            'tiller',
+            **kube_args
         )
 
         kubectl(
@@ -104,14 +325,16 @@ class ClusterList(object):
             'clusterrolebinding',
             'tiller',
             '--clusterrole=cluster-admin',
-            '--serviceaccount=kube-system:tiller'
+            '--serviceaccount=kube-system:tiller',
+            **kube_args
         )
 
         # -------- Initialize Helm -----------
         helm(
             'init',
             '--service-account',
-            'tiller'
+            'tiller',
+            **kube_args
         )
 
         # --------- Secure Helm --------------
@@ -121,7 +344,8 @@ class ClusterList(object):
             'tiller-deploy',
             namespace='kube-system',
             type='json',
-            patch='[{"op": "add", "path": "/spec/template/spec/containers/0/command", "value": ["/tiller", "--listen=localhost:44134"]}]'
+            patch='[{"op": "add", "path": "/spec/template/spec/containers/0/command", "value": ["/tiller", "--listen=localhost:44134"]}]',
+            **kube_args
         )
 
     def delete(self, name, provider='AwsEKS'):
@@ -132,12 +356,24 @@ class ClusterList(object):
 
         # Create cluster object
         Cluster = getattr(providers, provider)
-        cluster = Cluster(name)
+        cluster = Cluster(name, config=self.config)
         cluster.delete()
 
+        if cluster.plan.dry_run:
+            cluster.plan.write()
+            cluster.plan.print_summary()
+            return
+
         # Remove from kubeconf
         self.kubeconf.open()
-        self.kubeconf.remove_context(name)
-        self.kubeconf.remove_user(name)
-        self.kubeconf.remove_cluster(cluster.cluster_name)
+        try:
+            self.kubeconf.remove_context(name)
+            self.kubeconf.remove_user(name)
+            self.kubeconf.remove_cluster(cluster.cluster_name)
+        except Exception:
+            self.kubeconf.release()
+            raise
         self.kubeconf.close()
+
+        # Remove from the local state.
+        self.store.delete_cluster(name)
@@ -1,68 +1,206 @@
 import os
+import re
 import boto3
 import botocore
+import botocore.config
+import botocore.exceptions
 import jinja2
 import json
+import math
 import subprocess
 import logging
 import pathlib
+import threading
+import time
 
 import tqdm
 
 from traitlets import (
     Unicode,
+    Integer,
+    Float,
+    Bool,
+    Enum,
+    List,
+    Dict,
     default
 )
 from jhubctl.clusters.cluster import Cluster
-from ....utils import get_template
-
-
-CLIENT = boto3.client('cloudformation')
-CREATE_WAITER = CLIENT.get_waiter('stack_create_complete')
-DELETE_WAITER = CLIENT.get_waiter('stack_delete_complete')
-CLOUDFORMATION = boto3.resource('cloudformation')
-IAM = boto3.client('iam')
-EKS = boto3.client('eks')
-
-
-def stack_exists(name):
-    """Use boto3 to check if a resource exists."""
-    try:
-        CLIENT.describe_stacks(StackName=name)
-        return True
-    except:
-        return False
-
-
-def get_stack(name):
-    """Get stack from AWS's cloud formation."""
-    stack_exists(name)
-    stack = CLOUDFORMATION.Stack(f"{name}")
-    return stack
- 
-
-def create_stack(
-        stack_name,
-        stack_template_path,
-        parameters=None,
-        capabilities=None
-    ):
-    # Create stack if it does not exist.
-    if stack_exists(stack_name) is False:
-        # Create stack
-        options = {}
-        if parameters is not None:
-            options.update(Parameters=parameters)
-        if capabilities is not None:
-            options.update(Capabilities=capabilities)
-
-        stack = CLOUDFORMATION.create_stack(
-            StackName=stack_name,
-            TemplateBody=get_template(stack_template_path),
-            **options
-        )
-        # Wait for response.
-        CREATE_WAITER.wait(StackName=stack.name)
+from jhubctl.hubs.hub import Hub
+from ....utils import get_template, kubectl, JhubctlError, YAML, NODE_POOL_LABEL
+from ....plan import placeholder
+from ....preflight import PreflightWarning
+
+
+# boto3 sessions and clients, shared by every cluster in this process.
+SESSIONS = {}
+CLIENTS = {}
+SESSION_LOCK = threading.Lock()
+
+# Members of IAM groups, keyed by (profile, group name), with the
+# time they were listed.
+ADMINS = {}
+
+# Lists of the aws-auth ConfigMap, and the key identifying their entries.
+AUTH_ENTRY_KEYS = {
+    'mapRoles': 'rolearn',
+    'mapUsers': 'userarn',
+}
+
+# Annotation listing the aws-auth entries jhubctl manages.
+MANAGED_ANNOTATION = 'jhubctl/managed-arns'
+
+# Rough time (seconds) CloudFormation takes to create each stack,
+# used to estimate the duration of a dry-run plan.
+STACK_ESTIMATES = {
+    'amazon-eks-service-role.yaml': 60,
+    'amazon-eks-vpc.yaml': 180,
+    'amazon-eks-cluster.yaml': 720,
+    'amazon-eks-nodegroup.yaml': 240,
+    'amazon-spot-nodes.yaml': 180,
+    'amazon-utilities.yaml': 300,
+}
+
+
+# EBS volume types only the EBS CSI driver provisions.
+CSI_VOLUME_TYPES = ('gp3', 'io2')
+
+# Provisioners of EBS storage classes.
+IN_TREE_PROVISIONER = 'kubernetes.io/aws-ebs'
+CSI_PROVISIONER = 'ebs.csi.aws.com'
+
+
+# Service quota codes limiting the vCPUs of running instances, by
+# instance family. Every other family counts against 'standard'.
+VCPU_QUOTAS = {
+    'on-demand': {
+        'standard': 'L-1216C47A',
+        'g': 'L-DB2E81BA',
+        'p': 'L-417A185B',
+        'x': 'L-7295265B',
+    },
+    'spot': {
+        'standard': 'L-34B43A08',
+        'g': 'L-3819A6DF',
+        'p': 'L-7212CCBC',
+        'x': 'L-E3A00192',
+    },
+}
+
+
+# vCPUs, memory (GiB) and maximum pods (the EKS AMI's eni-max-pods) of
+# the instance types nodes may run on.
+INSTANCE_SPECS = {
+    't2.small': (1, 2, 11),
+    't2.medium': (2, 4, 17),
+    't2.large': (2, 8, 35),
+    't2.xlarge': (4, 16, 44),
+    't2.2xlarge': (8, 32, 44),
+    't3.small': (2, 2, 11),
+    't3.medium': (2, 4, 17),
+    't3.large': (2, 8, 35),
+    't3.xlarge': (4, 16, 58),
+    't3.2xlarge': (8, 32, 58),
+    't3a.small': (2, 2, 8),
+    't3a.medium': (2, 4, 17),
+    't3a.large': (2, 8, 35),
+    't3a.xlarge': (4, 16, 58),
+    't3a.2xlarge': (8, 32, 58),
+    'm3.medium': (1, 3.75, 12),
+    'm3.large': (2, 7.5, 29),
+    'm3.xlarge': (4, 15, 58),
+    'm3.2xlarge': (8, 30, 118),
+    'm4.large': (2, 8, 20),
+    'm4.xlarge': (4, 16, 58),
+    'm4.2xlarge': (8, 32, 58),
+    'm4.4xlarge': (16, 64, 234),
+    'm4.10xlarge': (40, 160, 234),
+    'm5.large': (2, 8, 29),
+    'm5.xlarge': (4, 16, 58),
+    'm5.2xlarge': (8, 32, 58),
+    'm5.4xlarge': (16, 64, 234),
+    'm5.12xlarge': (48, 192, 234),
+    'm5.24xlarge': (96, 384, 737),
+    'c4.large': (2, 3.75, 29),
+    'c4.xlarge': (4, 7.5, 58),
+    'c4.2xlarge': (8, 15, 58),
+    'c4.4xlarge': (16, 30, 234),
+    'c4.8xlarge': (36, 60, 234),
+    'c5.large': (2, 4, 29),
+    'c5.xlarge': (4, 8, 58),
+    'c5.2xlarge': (8, 16, 58),
+    'c5.4xlarge': (16, 32, 234),
+    'c5.9xlarge': (36, 72, 234),
+    'c5.18xlarge': (72, 144, 737),
+    'i3.large': (2, 15.25, 29),
+    'i3.xlarge': (4, 30.5, 58),
+    'i3.2xlarge': (8, 61, 58),
+    'i3.4xlarge': (16, 122, 234),
+    'i3.8xlarge': (32, 244, 234),
+    'i3.16xlarge': (64, 488, 737),
+    'r3.xlarge': (4, 30.5, 58),
+    'r3.2xlarge': (8, 61, 58),
+    'r3.4xlarge': (16, 122, 234),
+    'r3.8xlarge': (32, 244, 234),
+    'r4.large': (2, 15.25, 29),
+    'r4.xlarge': (4, 30.5, 58),
+    'r4.2xlarge': (8, 61, 58),
+    'r4.4xlarge': (16, 122, 234),
+    'r4.8xlarge': (32, 244, 234),
+    'r4.16xlarge': (64, 488, 737),
+    'x1.16xlarge': (64, 976, 234),
+    'x1.32xlarge': (128, 1952, 234),
+    'p2.xlarge': (4, 61, 58),
+    'p2.8xlarge': (32, 488, 234),
+    'p2.16xlarge': (64, 732, 234),
+    'p3.2xlarge': (8, 61, 58),
+    'p3.8xlarge': (32, 244, 234),
+    'p3.16xlarge': (64, 488, 234),
+}
+
+
+def get_reserved_cpu(vcpus):
+    """CPU (cores) the EKS AMI reserves for the kubelet: 6% of the
+    first core, 1% of the second, 0.5% of the next two and 0.25% of
+    the rest.
+    """
+    shares = [0.06, 0.01, 0.005, 0.005]
+    reserved = sum(share for share in shares[:math.ceil(vcpus)])
+    reserved += max(0, vcpus - 4) * 0.0025
+    return reserved
+
+
+def get_vcpu_quota_code(market, instance_type):
+    """Get the code of the vCPU quota an instance type counts against."""
+    family = re.match(r'[a-z]*', instance_type).group()
+    family = {'vt': 'g'}.get(family, family)
+    quotas = VCPU_QUOTAS[market]
+    return quotas.get(family, quotas['standard'])
+
+
+def get_role_mapping_arn(arn):
+    """Strip the path from a role ARN; aws-auth does not match
+    role ARNs that include one.
+    """
+    prefix, _, name = arn.partition(':role/')
+    if name == '':
+        return arn
+    return f"{prefix}:role/{name.split('/')[-1]}"
+
+
+def get_bootstrap_arguments(pool):
+    """Arguments for the EKS bootstrap script labeling nodes with
+    their pool.
+    """
+    return f"--kubelet-extra-args --node-labels={NODE_POOL_LABEL}={pool}"
+
+
+def get_endpoint_logical_id(service):
+    """CloudFormation name of the interface endpoint for a service,
+    e.g. 'EcrDkrEndpoint' for 'ecr.dkr'.
+    """
+    parts = re.split(r'[^A-Za-z0-9]+', service)
+    return ''.join(part.capitalize() for part in parts) + 'Endpoint'
 
 
 def get_stack_value(stack, key):
@@ -148,56 +286,411 @@ class AwsEKS(Cluster):
     def _default_utilities_name(self):
         return f'{self.name}-utilities'
 
+    # ------------------------------------------------------------------------
+    # VPC endpoints
+    # ------------------------------------------------------------------------
+
+    s3_endpoint = Bool(
+        False,
+        help="Add an S3 gateway endpoint to the VPC. Image layers pulled "
+             "from ECR are served by S3 and then stay in the AWS network. "
+             "Gateway endpoints are free."
+    ).tag(config=True)
+
+    interface_endpoints = List(
+        Unicode(),
+        help="Services to add interface endpoints for in each subnet, "
+             "e.g. ['ecr.api', 'ecr.dkr', 'sts']. Interface endpoints "
+             "are billed per hour and availability zone."
+    ).tag(config=True)
+
+    # ------------------------------------------------------------------------
+    # Nodes
+    # ------------------------------------------------------------------------
+
+    node_pool = Unicode(
+        u'on-demand',
+        help=f"Node pool ('{NODE_POOL_LABEL}' label) of the on-demand nodes."
+    ).tag(config=True)
+
+    node_instance_type = Unicode(
+        u't2.medium',
+        help="EC2 instance type of the on-demand nodes."
+    ).tag(config=True)
+
+    node_min_size = Integer(
+        1,
+        help="Minimum number of on-demand nodes."
+    ).tag(config=True)
+
+    node_max_size = Integer(
+        1,
+        help="Maximum number of on-demand nodes."
+    ).tag(config=True)
+
+    spot_pool = Unicode(
+        u'spot',
+        help=f"Node pool ('{NODE_POOL_LABEL}' label) of the spot nodes."
+    ).tag(config=True)
+
+    spot_instance_types = List(
+        Unicode(),
+        default_value=['t3.medium', 't3a.medium', 't2.medium'],
+        help="EC2 instance types the spot nodes may run on. Types of "
+             "similar size keep the autoscaler's estimates accurate."
+    ).tag(config=True)
+
+    spot_allocation_strategy = Enum(
+        ['capacity-optimized', 'capacity-optimized-prioritized', 'lowest-price'],
+        default_value='capacity-optimized',
+        help="How spot nodes are spread over the instance types."
+    ).tag(config=True)
+
+    spot_on_demand_base = Integer(
+        0,
+        help="Number of nodes in the spot group that run on-demand."
+    ).tag(config=True)
+
+    spot_on_demand_percentage = Integer(
+        0,
+        help="Percentage of the spot group's nodes beyond `spot_on_demand_base` "
+             "that run on-demand."
+    ).tag(config=True)
+
+    spot_min_size = Integer(
+        1,
+        help="Minimum number of spot nodes."
+    ).tag(config=True)
+
+    spot_max_size = Integer(
+        3,
+        help="Maximum number of spot nodes."
+    ).tag(config=True)
+
+    prepull_images = List(
+        Unicode(),
+        help="Images every node pulls before it joins the cluster, so "
+             "the first users landing on a new node do not wait for them."
+    ).tag(config=True)
+
+    prepull_hub_images = Bool(
+        True,
+        help="Also pull the singleuser images of the `Hub` config (e.g. "
+             "`Hub.config_file`) before the node joins the cluster."
+    ).tag(config=True)
+
+    instance_specs = Dict(
+        help="vCPUs, memory (GiB) and max pods of instance types missing "
+             "from the built-in table, for capacity planning, e.g. "
+             "{'m6i.large': {'cpu': 2, 'memory': 8, 'pods': 29}}."
+    ).tag(config=True)
+
+    # ------------------------------------------------------------------------
+    # Cluster autoscaler
+    # ------------------------------------------------------------------------
+
+    autoscaler = Bool(
+        True,
+        help="Install the cluster autoscaler. Node groups then start at "
+             "their minimum size and scale with demand; otherwise they "
+             "run at their maximum size."
+    ).tag(config=True)
+
+    autoscaler_image = Unicode(
+        u'k8s.gcr.io/cluster-autoscaler:v1.14.7',
+        help="Cluster autoscaler image; its minor version should match "
+             "the cluster's Kubernetes version."
+    ).tag(config=True)
+
+    autoscaler_expander = Enum(
+        ['random', 'most-pods', 'least-waste', 'priority'],
+        default_value='least-waste',
+        help="Strategy picking the node group to scale up."
+    ).tag(config=True)
+
+    scale_down_delay = Unicode(
+        u'10m',
+        help="How long after a scale up before nodes are considered for scale down."
+    ).tag(config=True)
+
+    scale_down_unneeded_time = Unicode(
+        u'10m',
+        help="How long a node must be unneeded before it is removed."
+    ).tag(config=True)
+
+    # ------------------------------------------------------------------------
+    # Block storage
+    # ------------------------------------------------------------------------
+
+    storage_classes = Dict(
+        default_value={'gp2': {'type': 'gp2'}},
+        help="EBS storage classes to create, by name. Each class takes a "
+             "'type' (gp2, gp3, io1, io2, st1 or sc1) and optionally 'iops', "
+             "'throughput' (MiB/s, gp3 only), 'fsType' and 'volumeBindingMode', "
+             "e.g. {'fast': {'type': 'io2', 'iops': 4000, 'fsType': 'xfs'}}."
+    ).tag(config=True)
+
+    default_storage_class = Unicode(
+        u'gp2',
+        help="Storage class used by claims that do not name one."
+    ).tag(config=True)
+
+    ebs_csi_driver = Unicode(
+        u'github.com/kubernetes-sigs/aws-ebs-csi-driver/deploy/kubernetes/overlays/stable/?ref=release-0.9',
+        help="Kustomization installing the EBS CSI driver, which provisions "
+             "gp3 and io2 volumes and volumes with set IOPS or throughput."
+    ).tag(config=True)
+
+    # ------------------------------------------------------------------------
+    # Shared storage
+    # ------------------------------------------------------------------------
+
+    efs_performance_mode = Enum(
+        ['generalPurpose', 'maxIO'],
+        default_value='generalPurpose',
+        help="Performance mode of the shared EFS file system."
+    ).tag(config=True)
+
+    efs_throughput_mode = Enum(
+        ['bursting', 'provisioned'],
+        default_value='bursting',
+        help="Throughput mode of the shared EFS file system. Bursting "
+             "throughput scales with the stored data and runs on credits."
+    ).tag(config=True)
+
+    efs_provisioned_throughput = Float(
+        0.0,
+        help="Throughput (MiB/s) of the shared EFS file system when "
+             "`efs_throughput_mode` is 'provisioned'."
+    ).tag(config=True)
+
+    efs_provisioner_image = Unicode(
+        u'quay.io/external_storage/efs-provisioner:v2.4.0',
+        help="Image of the EFS provisioner serving the 'aws-efs' storage class."
+    ).tag(config=True)
+
+    # ------------------------------------------------------------------------
+    # Cluster access
+    # ------------------------------------------------------------------------
+
+    admin_groups = List(
+        Unicode(),
+        default_value=['admin'],
+        help="IAM groups whose users are mapped to system:masters."
+    ).tag(config=True)
+
+    admin_roles = List(
+        Unicode(),
+        help="ARNs of IAM roles mapped to system:masters."
+    ).tag(config=True)
+
+    admin_cache_ttl = Float(
+        300.0,
+        help="Seconds to reuse the members of an IAM group before listing them again."
+    ).tag(config=True)
+
+    # ------------------------------------------------------------------------
+    # AWS session
+    # ------------------------------------------------------------------------
+
+    region = Unicode(
+        help="AWS region to deploy the cluster into. Falls back to the "
+             "region configured in the environment."
+    ).tag(config=True)
+
+    profile = Unicode(
+        help="AWS credentials profile. Falls back to the default profile."
+    ).tag(config=True)
+
+    retry_mode = Unicode(
+        u'adaptive',
+        help="Botocore retry mode ('legacy', 'standard' or 'adaptive')."
+    ).tag(config=True)
+
+    max_attempts = Integer(
+        10,
+        help="Maximum number of attempts for a throttled or failed AWS call."
+    ).tag(config=True)
+
+    max_pool_connections = Integer(
+        50,
+        help="Size of the HTTP connection pool shared by each AWS client."
+    ).tag(config=True)
+
+    @property
+    def session(self):
+        """boto3 session shared by every client and resource of this cluster."""
+        key = (self.region, self.profile)
+        with SESSION_LOCK:
+            if key not in SESSIONS:
+                options = {}
+                if self.region != '':
+                    options.update(region_name=self.region)
+                if self.profile != '':
+                    options.update(profile_name=self.profile)
+                SESSIONS[key] = boto3.session.Session(**options)
+            return SESSIONS[key]
+
+    @property
+    def botocore_config(self):
+        """Botocore client configuration built from the session traits."""
+        return botocore.config.Config(
+            retries={
+                'mode': self.retry_mode,
+                'max_attempts': self.max_attempts
+            },
+            max_pool_connections=self.max_pool_connections
+        )
+
+    def _get_boto(self, kind, service_name):
+        """Get a cached boto3 client or resource. Clusters with the same
+        session traits share them, so they stay warm across clusters in
+        a long-running process.
+        """
+        key = (
+            kind,
+            service_name,
+            self.region,
+            self.profile,
+            self.retry_mode,
+            self.max_attempts,
+            self.max_pool_connections
+        )
+        session = self.session
+        # boto3 sessions are not thread safe; guard client creation.
+        with SESSION_LOCK:
+            if key not in CLIENTS:
+                factory = getattr(session, kind)
+                CLIENTS[key] = factory(
+                    service_name,
+                    config=self.botocore_config
+                )
+            return CLIENTS[key]
+
+    def client(self, service_name):
+        """Get a (cached) boto3 client for an AWS service."""
+        return self._get_boto('client', service_name)
+
+    def resource(self, service_name):
+        """Get a (cached) boto3 resource for an AWS service."""
+        return self._get_boto('resource', service_name)
+
+    @property
+    def cloudformation(self):
+        return self.client('cloudformation')
+
+    @property
+    def eks(self):
+        return self.client('eks')
+
+    @property
+    def iam(self):
+        return self.client('iam')
+
+    @property
+    def ec2(self):
+        return self.client('ec2')
+
     # ------------------------------------------------------------------------
     # Provider Attributes
     # ------------------------------------------------------------------------
 
+    def get_stack_output(self, stack_name, key):
+        """Get an output of a stack; a placeholder in dry-run mode."""
+        if self.plan.dry_run:
+            return placeholder(stack_name, key)
+        return get_stack_value(self.get_stack(stack_name), key)
+
+    def get_stack_resource_id(self, stack_name, logical_id):
+        """Get the physical id of a stack's resource; a placeholder
+        in dry-run mode.
+        """
+        if self.plan.dry_run:
+            return placeholder(stack_name, logical_id)
+        return self.get_stack(stack_name).Resource(logical_id).physical_resource_id
+
     @property
     def security_groups(self):
-        return get_stack_value(self.vpc_stack, "SecurityGroups")
+        return self.get_stack_output(self.vpc_name, "SecurityGroups")
 
     @property
     def subnet_ids(self):
-        return get_stack_value(self.vpc_stack, "SubnetIds")
+        return self.get_stack_output(self.vpc_name, "SubnetIds")
 
     @property
     def vpc_ids(self):
-        return get_stack_value(self.vpc_stack, "VpcId")
+        return self.get_stack_output(self.vpc_name, "VpcId")
 
     @property
     def endpoint_url(self):
-        response = EKS.describe_cluster(name=self.cluster_name)
+        response = self.eks.describe_cluster(name=self.cluster_name)
         return response['cluster']['endpoint']
 
     @property
     def ca_cert(self):
-        response = EKS.describe_cluster(name=self.cluster_name)
+        response = self.eks.describe_cluster(name=self.cluster_name)
         return response['cluster']['certificateAuthority']['data']
 
     @property
     def node_arn(self):
-        return get_stack_value(self.node_group_stack, "NodeInstanceRole")
+        return self.get_stack_output(self.node_group_name, "NodeInstanceRole")
 
     @property
     def node_instance_profile(self):
-        return self.node_group_stack.Resource('NodeInstanceProfile').physical_resource_id
+        return self.get_stack_resource_id(self.node_group_name, 'NodeInstanceProfile')
 
     @property
     def node_instance_role(self):
-        return self.node_group_stack.Resource('NodeInstanceRole').physical_resource_id
+        return self.get_stack_resource_id(self.node_group_name, 'NodeInstanceRole')
 
     @property
     def node_security_group(self):
-        return self.node_group_stack.Resource('NodeSecurityGroup').physical_resource_id
+        return self.get_stack_resource_id(self.node_group_name, 'NodeSecurityGroup')
 
     @property
     def efs_id(self):
-        return get_stack_value(self.utilities_stack, 'efsId')
+        return self.get_stack_output(self.utilities_name, 'EfsId')
+
+    @property
+    def region_name(self):
+        """Region of the cluster; a placeholder in dry-run mode if it
+        is not configured.
+        """
+        region = self.session.region_name
+        if region is None and self.plan.dry_run:
+            region = placeholder('aws', 'region')
+        return region
+
+    def get_group_users(self, group_name):
+        """Get every user of an IAM group.
+
+        Groups are listed page by page, and their members are cached
+        for `admin_cache_ttl` seconds.
+        """
+        key = (self.profile, group_name)
+        cached = ADMINS.get(key)
+        if cached is not None and time.time() - cached[0] < self.admin_cache_ttl:
+            return cached[1]
+        users = []
+        paginator = self.iam.get_paginator('get_group')
+        for page in paginator.paginate(GroupName=group_name):
+            users.extend(page['Users'])
+        ADMINS[key] = (time.time(), users)
+        return users
 
     @property
     def admins(self):
-        """Admins of the cluster."""
-        return IAM.get_group(GroupName="admin")["Users"]
+        """Admins of the cluster: the users of every admin group."""
+        if self.plan.dry_run:
+            return [{
+                'Arn': placeholder('iam', f'{group}.Arn'),
+                'UserName': placeholder('iam', f'{group}.UserName')
+            } for group in self.admin_groups]
+        admins = {}
+        for group in self.admin_groups:
+            for user in self.get_group_users(group):
+                admins.setdefault(user['Arn'], user)
+        return list(admins.values())
 
     # ------------------------------------------------------------------------
     # Stacks
@@ -205,23 +698,35 @@ class AwsEKS(Cluster):
 
     @property
     def role_stack(self):
-        return get_stack(self.role_name)
+        return self.get_stack(self.role_name)
 
     @property
     def vpc_stack(self):
-        return get_stack(self.vpc_name)
+        return self.get_stack(self.vpc_name)
 
     @property
     def node_group_stack(self):
-        return get_stack(self.node_group_name)
+        return self.get_stack(self.node_group_name)
 
     @property
     def spot_nodes_stack(self):
-        return get_stack(self.spot_nodes_name)
+        return self.get_stack(self.spot_nodes_name)
 
     @property
     def utilities_stack(self):
-        return get_stack(self.utilities_name)
+        return self.get_stack(self.utilities_name)
+
+    @property
+    def stack_names(self):
+        """Names of the stacks making up the cluster, in creation order."""
+        return [
+            self.role_name,
+            self.vpc_name,
+            self.cluster_name,
+            self.node_group_name,
+            self.spot_nodes_name,
+            self.utilities_name
+        ]
 
     @property
     def kube_user_data(self):
@@ -260,67 +765,495 @@ class AwsEKS(Cluster):
 
     def delete(self):
         """Delete a running cluster."""
-        stacks = [
-            self.utilities_name,
-            self.spot_nodes_name,
-            self.node_group_name,
-            self.cluster_name,
-            self.vpc_name,
-            self.role_name
-        ]
+        stacks = list(reversed(self.stack_names))
+        if self.plan.dry_run:
+            for i, stack in enumerate(stacks):
+                self.plan.add_step(
+                    stack,
+                    'delete CloudFormation stack',
+                    depends_on=stacks[:i][-1:],
+                    estimate=STACK_ESTIMATES.get(self.get_stack_template(stack), 60)
+                )
+            return
         # Execute creation.
         for stack in tqdm.tqdm(stacks, ncols=70):
             self.delete_stack(stack)
 
+    def get_stacks(self):
+        """Get the status of each CloudFormation stack of the cluster."""
+        stacks = {}
+        for stack_name in self.stack_names:
+            try:
+                response = self.cloudformation.describe_stacks(
+                    StackName=stack_name)
+                stacks[stack_name] = response['Stacks'][0]['StackStatus']
+            except botocore.exceptions.ClientError:
+                stacks[stack_name] = 'DOES_NOT_EXIST'
+        return stacks
+
+    # ------------------------------------------------------------------------
+    # Pre-flight checks
+    # ------------------------------------------------------------------------
+
+    def get_preflight_checks(self):
+        return [
+            ("SSH key pair", self.check_ssh_key),
+            ("Cluster admins", self.check_admins),
+            ("EC2 vCPU quotas", self.check_vcpu_quotas),
+            ("Stack names", self.check_stack_names),
+            ("EFS throughput", self.check_efs_throughput),
+        ]
+
+    def check_ssh_key(self):
+        """Check that the nodes' SSH key pair exists in the region."""
+        if self.ssh_key_name == '':
+            raise JhubctlError("no key pair given; set --AwsEKS.ssh_key_name.")
+        try:
+            self.ec2.describe_key_pairs(KeyNames=[self.ssh_key_name])
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] == 'InvalidKeyPair.NotFound':
+                raise JhubctlError(
+                    f"key pair '{self.ssh_key_name}' does not exist in "
+                    f"{self.ec2.meta.region_name}.")
+            raise
+        return self.ssh_key_name
+
+    def check_admins(self):
+        """Check that there are admins to map into the cluster."""
+        users = {}
+        for group in self.admin_groups:
+            try:
+                for user in self.get_group_users(group):
+                    users[user['Arn']] = user
+            except self.iam.exceptions.NoSuchEntityException:
+                raise JhubctlError(f"IAM group '{group}' does not exist.")
+        if len(users) + len(self.admin_roles) == 0:
+            raise PreflightWarning(
+                "no users in the admin groups and no admin roles; "
+                "nobody will have cluster access.")
+        return f"{len(users)} user(s), {len(self.admin_roles)} role(s)"
+
+    def get_spot_on_demand_count(self, size):
+        """Number of on-demand nodes when the spot group has `size` nodes."""
+        base = min(size, self.spot_on_demand_base)
+        above = math.ceil((size - base) * self.spot_on_demand_percentage / 100)
+        return base + above
+
+    # ------------------------------------------------------------------------
+    # Capacity
+    # ------------------------------------------------------------------------
+
+    def get_node_groups(self):
+        return [
+            dict(
+                pool=self.node_pool,
+                instance_types=[self.node_instance_type],
+                min_size=self.node_min_size,
+                max_size=self.node_max_size,
+                on_demand=self.node_max_size
+            ),
+            dict(
+                pool=self.spot_pool,
+                instance_types=list(self.spot_instance_types),
+                min_size=self.spot_min_size,
+                max_size=self.spot_max_size,
+                on_demand=self.get_spot_on_demand_count(self.spot_max_size)
+            ),
+        ]
+
+    def get_allocatable(self, instance_type):
+        """Resources the kubelet of an EKS node offers to pods, after the
+        AMI's kube-reserved and eviction thresholds.
+        """
+        if instance_type in self.instance_specs:
+            spec = self.instance_specs[instance_type]
+            vcpus, memory, pods = spec['cpu'], spec['memory'], spec['pods']
+        elif instance_type in INSTANCE_SPECS:
+            vcpus, memory, pods = INSTANCE_SPECS[instance_type]
+        else:
+            raise JhubctlError(
+                f"Unknown instance type '{instance_type}'; describe it with "
+                f"--AwsEKS.instance_specs.")
+        # kube-reserved memory is 255Mi plus 11Mi per pod; the eviction
+        # threshold keeps another 100Mi free.
+        reserved_memory = (255 + 11 * pods + 100) * 2**20
+        return dict(
+            cpu=vcpus - get_reserved_cpu(vcpus),
+            memory=memory * 2**30 - reserved_memory,
+            pods=pods
+        )
+
+    def check_vcpu_quotas(self):
+        """Check that the nodes fit in the account's vCPU quotas.
+
+        A group of mixed instance types may launch all its nodes from the
+        largest type, so that is what is counted.
+        """
+        spot_on_demand = self.get_spot_on_demand_count(self.spot_max_size)
+        nodes = [
+            ('on-demand', [self.node_instance_type], self.node_max_size),
+            ('on-demand', self.spot_instance_types, spot_on_demand),
+            ('spot', self.spot_instance_types, self.spot_max_size - spot_on_demand),
+        ]
+        instance_types = sorted({t for node in nodes for t in node[1]})
+        response = self.ec2.describe_instance_types(InstanceTypes=instance_types)
+        vcpus = {
+            t['InstanceType']: t['VCpuInfo']['DefaultVCpus']
+            for t in response['InstanceTypes']
+        }
+        required = {}
+        for market, types, count in nodes:
+            largest = {}
+            for instance_type in types:
+                key = (market, get_vcpu_quota_code(market, instance_type))
+                largest[key] = max(largest.get(key, 0), vcpus[instance_type])
+            for key, size in largest.items():
+                required[key] = required.get(key, 0) + size * count
+
+        quotas = self.client('service-quotas')
+        messages, problems = [], []
+        for (market, code), needed in required.items():
+            response = quotas.get_service_quota(ServiceCode='ec2', QuotaCode=code)
+            quota = response['Quota']['Value']
+            message = f"{market} needs {needed} of {quota:g} vCPUs ({code})"
+            if needed > quota:
+                problems.append(message)
+            messages.append(message)
+        if problems:
+            raise JhubctlError('; '.join(problems))
+        return '; '.join(messages)
+
+    def check_efs_throughput(self):
+        """Check that a provisioned EFS is given a throughput."""
+        if self.efs_throughput_mode == 'bursting':
+            return 'bursting'
+        if self.efs_provisioned_throughput <= 0:
+            raise JhubctlError(
+                "set --AwsEKS.efs_provisioned_throughput (MiB/s) for "
+                "provisioned throughput.")
+        return f"{self.efs_provisioned_throughput:g} MiB/s provisioned"
+
+    def check_stack_names(self):
+        """Check that the names of the cluster's stacks are free.
+
+        Complete stacks are reused by `create`; stacks that failed or
+        are changing must be deleted first.
+        """
+        stacks = self.get_stacks()
+        blocked = [
+            f"{name} ({status})" for name, status in stacks.items()
+            if status != 'DOES_NOT_EXIST' and (
+                status == 'ROLLBACK_COMPLETE' or not status.endswith('_COMPLETE'))
+        ]
+        if blocked:
+            raise JhubctlError(
+                f"delete these stacks first: {', '.join(blocked)}")
+        if stacks[self.cluster_name] == 'DOES_NOT_EXIST':
+            try:
+                self.eks.describe_cluster(name=self.cluster_name)
+            except self.eks.exceptions.ResourceNotFoundException:
+                pass
+            else:
+                raise JhubctlError(
+                    f"EKS cluster {self.cluster_name} already exists "
+                    "outside of jhubctl.")
+        reused = [name for name, status in stacks.items() if status != 'DOES_NOT_EXIST']
+        if reused:
+            raise PreflightWarning(
+                f"existing stacks will be reused: {', '.join(reused)}")
+
+    def get_auth_entries(self):
+        """Get the role and user mappings of the aws-auth ConfigMap."""
+        roles = [{
+            'rolearn': self.node_arn,
+            'username': 'system:node:{{EC2PrivateDNSName}}',
+            'groups': ['system:bootstrappers', 'system:nodes']
+        }]
+        for arn in self.admin_roles:
+            arn = get_role_mapping_arn(arn)
+            roles.append({
+                'rolearn': arn,
+                'username': arn.rpartition('/')[2],
+                'groups': ['system:masters']
+            })
+        users = [{
+            'userarn': user['Arn'],
+            'username': user['UserName'],
+            'groups': ['system:masters']
+        } for user in self.admins]
+        return {'mapRoles': roles, 'mapUsers': users}
+
     def get_auth_config(self):
         """Return the Authorization Config Map (in yaml format) 
         for this cluster.
         """
+        entries = self.get_auth_entries()
         return self.get_template(
             'amazon-auth-cm.yaml',
-            arn=self.node_arn,
-            users=self.admins
+            roles=entries['mapRoles'],
+            users=entries['mapUsers'],
+            managed=sorted(
+                [role['rolearn'] for role in entries['mapRoles']] +
+                [user['userarn'] for user in entries['mapUsers']]
+            )
+        )
+
+    def apply_auth_config(self, kube_args):
+        """Bring the aws-auth ConfigMap up to date.
+
+        Only entries that changed are patched in, and only entries
+        jhubctl added earlier are removed; entries added by anyone
+        else are left alone. A new cluster gets the whole ConfigMap.
+        """
+        out = kubectl(
+            'get',
+            'configmap',
+            'aws-auth',
+            namespace='kube-system',
+            output='json',
+            **kube_args
+        )
+        if out.returncode != 0:
+            return super().apply_auth_config(kube_args)
+
+        configmap = json.loads(out.stdout)
+        data = configmap.get('data') or {}
+        annotations = configmap['metadata'].get('annotations') or {}
+        managed = set(json.loads(annotations.get(MANAGED_ANNOTATION, '[]')))
+        desired = self.get_auth_entries()
+
+        yaml = YAML()
+        patch = {}
+        added, removed, managed_now = 0, 0, set()
+        for key, id_key in AUTH_ENTRY_KEYS.items():
+            existing = yaml.load(data.get(key) or '[]') or []
+            wanted = {entry[id_key]: entry for entry in desired[key]}
+            managed_now.update(wanted)
+            entries = []
+            for entry in existing:
+                entry_id = entry.get(id_key)
+                if entry_id in wanted:
+                    entries.append(wanted.pop(entry_id))
+                elif entry_id in managed:
+                    removed += 1
+                else:
+                    entries.append(entry)
+            added += len(wanted)
+            entries.extend(wanted.values())
+            if entries != existing:
+                patch.setdefault('data', {})[key] = yaml.dump(entries)
+        if managed_now != managed:
+            patch['metadata'] = {'annotations': {
+                MANAGED_ANNOTATION: json.dumps(sorted(managed_now))
+            }}
+
+        if len(patch) == 0:
+            print("aws-auth is up to date.")
+            return
+        out = kubectl(
+            'patch',
+            'configmap',
+            'aws-auth',
+            namespace='kube-system',
+            type='merge',
+            patch=json.dumps(patch),
+            **kube_args
+        )
+        if out.returncode != 0:
+            raise JhubctlError(out.stderr)
+        print(f"Patched aws-auth: {added} added, {removed} removed.")
+
+    def get_prepull_images(self):
+        """Images nodes pull before they join, as a space-separated list."""
+        images = list(self.prepull_images)
+        if self.prepull_hub_images:
+            images += Hub(namespace='', config=self.config).get_images()
+        return ' '.join(dict.fromkeys(images))
+
+    def get_desired_capacity(self, min_size, max_size):
+        """Initial size of a node group."""
+        return str(min_size if self.autoscaler else max_size)
+
+    def get_autoscaler_config(self):
+        """Return the cluster autoscaler manifests (in yaml format), with
+        node groups found through their auto-discovery tags.
+        """
+        if self.autoscaler is False:
+            return ''
+        return self.get_template(
+            'amazon-cluster-autoscaler.yaml',
+            image=self.autoscaler_image,
+            cluster_name=self.cluster_name,
+            region=self.region_name,
+            expander=self.autoscaler_expander,
+            scale_down_delay=self.scale_down_delay,
+            scale_down_unneeded_time=self.scale_down_unneeded_time
         )
 
+    def get_shared_storage_config(self):
+        """Return the EFS provisioner (in yaml format) serving the
+        'aws-efs' storage class from the utilities stack's file system.
+        """
+        return self.get_template(
+            'amazon-efs-provisioner.yaml',
+            efsSystemId=self.efs_id,
+            region=self.region_name,
+            clusterName=self.cluster_name,
+            image=self.efs_provisioner_image
+        )
+
+    def get_storage_classes(self):
+        """Describe the EBS storage classes to create. Classes using
+        CSI-only volume types, IOPS or throughput are provisioned by
+        the EBS CSI driver.
+        """
+        if self.default_storage_class not in self.storage_classes:
+            raise JhubctlError(
+                f"Default storage class '{self.default_storage_class}' "
+                "is not one of `storage_classes`."
+            )
+        storage_classes = []
+        for name, options in self.storage_classes.items():
+            options = dict(options)
+            volume_type = options.pop('type', 'gp2')
+            fs_type = options.pop('fsType', 'ext4')
+            binding_mode = options.pop('volumeBindingMode', 'WaitForFirstConsumer')
+            csi = volume_type in CSI_VOLUME_TYPES or 'iops' in options or 'throughput' in options
+            parameters = {'type': volume_type}
+            if csi:
+                parameters['csi.storage.k8s.io/fstype'] = fs_type
+            else:
+                parameters['fsType'] = fs_type
+            parameters.update(options)
+            storage_classes.append(dict(
+                name=name,
+                default=name == self.default_storage_class,
+                provisioner=CSI_PROVISIONER if csi else IN_TREE_PROVISIONER,
+                volume_binding_mode=binding_mode,
+                parameters=parameters
+            ))
+        return storage_classes
+
     def get_storage_config(self):
         """Return the Storage configuration (in yaml format) 
         for this cluster.
         """
-        return self.get_template('amazon-storage-class.yaml')
+        return self.get_template(
+            'amazon-storage-class.yaml',
+            storage_classes=self.get_storage_classes()
+        )
+
+    def get_storage_drivers(self):
+        """Install the EBS CSI driver if a storage class needs it."""
+        for storage_class in self.get_storage_classes():
+            if storage_class['provisioner'] == CSI_PROVISIONER:
+                return [self.ebs_csi_driver]
+        return []
+
+    def apply_storage_config(self, kube_args):
+        """Replace the default gp2 class EKS creates with the configured
+        classes.
+        """
+        kubectl('delete', 'storageclass', 'gp2', **kube_args)
+        super().apply_storage_config(kube_args)
 
     def get_template(self, template_name, **parameters):
         """Pull templates from the AWS templates folder"""
         template_path = pathlib.Path(self.template_dir).joinpath(template_name)
         return get_template(template_path, **parameters)
 
+    def stack_exists(self, stack_name):
+        """Use boto3 to check if a stack exists."""
+        try:
+            self.cloudformation.describe_stacks(StackName=stack_name)
+            return True
+        except botocore.exceptions.ClientError:
+            return False
+
+    def get_stack(self, stack_name):
+        """Get stack from AWS's cloud formation."""
+        return self.resource('cloudformation').Stack(f"{stack_name}")
+
     def delete_stack(self, stack_name):
         """Teardown a stack."""
-        get_stack(stack_name)
-        CLIENT.delete_stack(
+        self.cloudformation.delete_stack(
             StackName=stack_name
         )
-        DELETE_WAITER.wait(StackName=stack_name)
+        waiter = self.cloudformation.get_waiter('stack_delete_complete')
+        waiter.wait(StackName=stack_name)
+
+    def get_stack_template(self, stack_name):
+        """Name of the template a stack of this cluster is created from."""
+        templates = dict(zip(self.stack_names, [
+            'amazon-eks-service-role.yaml',
+            'amazon-eks-vpc.yaml',
+            'amazon-eks-cluster.yaml',
+            'amazon-eks-nodegroup.yaml',
+            'amazon-spot-nodes.yaml',
+            'amazon-utilities.yaml'
+        ]))
+        return templates.get(stack_name)
 
     def create_stack(
         self, 
         stack_name,
         stack_template_name,
         parameters=None,
-        capabilities=None
+        capabilities=None,
+        depends_on=None,
+        template_parameters=None
         ):
-        """Create a stack using Amazon's Cloud formation"""
+        """Create a stack using Amazon's Cloud formation.
+
+        `template_parameters` are used to render the stack template
+        itself, for what CloudFormation parameters cannot express.
+        `depends_on` lists stacks that must exist first, beyond those
+        whose outputs are passed as parameters; it is only used to
+        order dry-run plans.
+        """
         # Build template_path
         stack_template_path = pathlib.Path(
             self.template_dir).joinpath(stack_template_name)
 
-        # Create stack
-        create_stack(
-            stack_name,
+        template_body = get_template(
             stack_template_path,
-            parameters=parameters,
-            capabilities=capabilities
+            **(template_parameters or {})
         )
 
+        options = {}
+        if parameters is not None:
+            options.update(Parameters=parameters)
+        if capabilities is not None:
+            options.update(Capabilities=capabilities)
+
+        # Record the stack instead of creating it.
+        if self.plan.dry_run:
+            self.plan.add_step(
+                stack_name,
+                f'create CloudFormation stack from {stack_template_name}',
+                files={
+                    'template.yaml': template_body,
+                    'stack.json': json.dumps(
+                        dict(StackName=stack_name, **options), indent=2)
+                },
+                depends_on=depends_on,
+                estimate=STACK_ESTIMATES.get(stack_template_name, 60)
+            )
+            return
+
+        # Create stack if it does not exist.
+        if self.stack_exists(stack_name) is True:
+            return
+
+        stack = self.resource('cloudformation').create_stack(
+            StackName=stack_name,
+            TemplateBody=template_body,
+            **options
+        )
+        # Wait for response.
+        waiter = self.cloudformation.get_waiter('stack_create_complete')
+        waiter.wait(StackName=stack.name)
+
     def create_role(self):
         """Create an EKS Role configured to create JupyterHub Deployments
         on an EKS Provider.
@@ -342,7 +1275,14 @@ class AwsEKS(Cluster):
                 VpcBlock="10.42.0.0/16",
                 Subnet01Block="10.42.1.0/24",
                 Subnet02Block="10.42.2.0/24",
-                Subnet03Block="10.42.3.0/24"
+                Subnet03Block="10.42.3.0/24",
+                S3GatewayEndpoint=str(self.s3_endpoint).lower()
+            ),
+            template_parameters=dict(
+                interface_endpoints=[
+                    dict(service=service, logical_id=get_endpoint_logical_id(service))
+                    for service in self.interface_endpoints
+                ]
             )
         )
 
@@ -366,13 +1306,21 @@ class AwsEKS(Cluster):
             self.node_group_name,
             'amazon-eks-nodegroup.yaml',
             capabilities=['CAPABILITY_IAM'],
+            depends_on=[self.cluster_name],
             parameters=define_parameters(
                 ClusterName=self.cluster_name,
                 ClusterControlPlaneSecurityGroup=self.security_groups,
                 Subnets=self.subnet_ids,
                 VpcId=self.vpc_ids,
                 KeyName=self.ssh_key_name,
-                NodeAutoScalingGroupMaxSize="1",
+                NodeInstanceType=self.node_instance_type,
+                BootstrapArguments=get_bootstrap_arguments(self.node_pool),
+                PrepullImages=self.get_prepull_images(),
+                NodeAutoScalingGroupMinSize=str(self.node_min_size),
+                NodeAutoScalingGroupMaxSize=str(self.node_max_size),
+                NodeAutoScalingGroupDesiredCapacity=self.get_desired_capacity(
+                    self.node_min_size, self.node_max_size),
+                NodePool=self.node_pool,
                 NodeVolumeSize="100",
                 NodeImageId="ami-0a54c984b9f908c81",
                 NodeGroupName=f"{self.name} OnDemand Nodes"
@@ -385,13 +1333,25 @@ class AwsEKS(Cluster):
         self.create_stack(
             self.spot_nodes_name,
             'amazon-spot-nodes.yaml',
+            depends_on=[self.cluster_name],
+            template_parameters=dict(instance_types=self.spot_instance_types),
             parameters=define_parameters(
                 ClusterName=self.cluster_name,
                 Subnets=self.subnet_ids,
+                KeyName=self.ssh_key_name,
+                OnDemandBaseCapacity=str(self.spot_on_demand_base),
+                OnDemandPercentageAboveBaseCapacity=str(self.spot_on_demand_percentage),
+                SpotAllocationStrategy=self.spot_allocation_strategy,
+                BootstrapArguments=get_bootstrap_arguments(self.spot_pool),
+                PrepullImages=self.get_prepull_images(),
+                NodeAutoScalingGroupMinSize=str(self.spot_min_size),
+                NodeAutoScalingGroupMaxSize=str(self.spot_max_size),
+                NodeAutoScalingGroupDesiredCapacity=self.get_desired_capacity(
+                    self.spot_min_size, self.spot_max_size),
+                NodePool=self.spot_pool,
                 NodeInstanceProfile=self.node_instance_profile,
                 NodeInstanceRole=self.node_instance_role,
                 NodeSecurityGroup=self.node_security_group,
-
             )
         )
 
@@ -403,6 +1363,9 @@ class AwsEKS(Cluster):
             'amazon-utilities.yaml',
             parameters=define_parameters(
                 Subnets=self.subnet_ids,
-                NodeSecurityGroup=self.node_security_group
+                NodeSecurityGroup=self.node_security_group,
+                PerformanceMode=self.efs_performance_mode,
+                ThroughputMode=self.efs_throughput_mode,
+                ProvisionedThroughputInMibps=str(self.efs_provisioned_throughput)
             )
         )
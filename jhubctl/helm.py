@@ -0,0 +1,103 @@
+from traitlets.config import Configurable
+from traitlets import Enum
+
+from .utils import helm
+
+
+def is_release_not_found(out, release):
+    """Check if a failed helm call failed because `release` does not
+    exist. Only helm's own messages count (Helm 2: 'release: "<name>"
+    not found', Helm 3: 'release: not found'); a missing context,
+    kubeconfig or namespace is another failure.
+    """
+    if out.returncode == 0:
+        return False
+    messages = (
+        f'Error: release: "{release}" not found',
+        'Error: release: not found',
+    )
+    return any(line.strip() in messages for line in out.stderr.splitlines())
+
+
+class Helm(Configurable):
+    """Helm client used to manage JupyterHub releases.
+
+    Helm 2 and Helm 3 differ in a few commands; this class maps
+    each operation jhubctl needs to the selected client version.
+    Helm 3 talks to the Kubernetes API directly, so clusters need
+    no Tiller and calls skip the Tiller port-forward.
+    """
+    version = Enum(
+        ['2', '3'],
+        default_value='2',
+        help="Major version of the helm client."
+    ).tag(config=True)
+
+    @property
+    def needs_tiller(self):
+        """Helm 2 runs its releases through Tiller."""
+        return self.version == '2'
+
+    def _namespaced(self, namespace, flags):
+        """Helm 3 releases live in a namespace; Helm 2 releases are global."""
+        if self.version == '3' and namespace is not None:
+            flags['namespace'] = namespace
+        return flags
+
+    def list(self, **flags):
+        """List releases in every namespace."""
+        if self.version == '3':
+            return helm('list', '--all-namespaces', **flags)
+        return helm('list', **flags)
+
+    def get(self, release, namespace=None, **flags):
+        """Get everything about a release."""
+        flags = self._namespaced(namespace, flags)
+        if self.version == '3':
+            return helm('get', 'all', release, **flags)
+        return helm('get', release, **flags)
+
+    def get_values(self, release, namespace=None, **flags):
+        """Get the values a release was deployed with."""
+        flags = self._namespaced(namespace, flags)
+        return helm('get', 'values', release, **flags)
+
+    def history(self, release, namespace=None, **flags):
+        """Get the revisions of a release."""
+        flags = self._namespaced(namespace, flags)
+        return helm('history', release, **flags)
+
+    def upgrade(self, release, chart, namespace, **flags):
+        """Install a release, or upgrade it if it exists."""
+        args = ['upgrade', '--install', release, chart]
+        # Helm 2 creates missing namespaces on its own.
+        if self.version == '3':
+            args.append('--create-namespace')
+        return helm(*args, namespace=namespace, **flags)
+
+    def upgrade_chart(self, release, chart, namespace, **flags):
+        """Upgrade an existing release to another chart, keeping the
+        values it was deployed with.
+        """
+        return helm(
+            'upgrade', release, chart, '--reuse-values',
+            namespace=namespace,
+            **flags
+        )
+
+    def rollback(self, release, revision, namespace=None, **flags):
+        """Roll a release back to an earlier revision."""
+        flags = self._namespaced(namespace, flags)
+        return helm('rollback', release, str(revision), **flags)
+
+    def delete(self, release, namespace=None, **flags):
+        """Delete a release and its history."""
+        if self.version == '3':
+            flags = self._namespaced(namespace, flags)
+            return helm('uninstall', release, **flags)
+        return helm('delete', release, '--purge', **flags)
+
+    def fetch(self, chart, **flags):
+        """Download a chart archive."""
+        command = 'pull' if self.version == '3' else 'fetch'
+        return helm(command, chart, **flags)
@@ -1,2 +1,3 @@
 from .hub_list import HubList
-from .hub import Hub
\ No newline at end of file
+from .hub import Hub
+from .upgrade import HubUpgrade
@@ -1,11 +1,118 @@
+import re
+import json
+import time
+import hashlib
 import secrets
 import pathlib
+import urllib.error
+import urllib.request
 
-from jhubctl.utils import helm, kubectl, YAML
+from jhubctl.utils import helm, kubectl, merge_config, YAML, JhubctlError, NODE_POOL_LABEL
+from jhubctl.charts import ChartCache, DEFAULT_CHART_VERSION
+from jhubctl.helm import Helm, is_release_not_found
+from jhubctl.plan import Plan, placeholder
+from jhubctl.store import format_age
+from jhubctl.watch import KubeWatch
 from traitlets.config import Configurable
-from traitlets import default, Unicode
+from traitlets import default, Unicode, Bool, Dict, Float
 
 
+# Prefix of the release description recording the config hash.
+HASH_PREFIX = 'jhubctl-config-hash='
+
+# Name of the JupyterHub chart, prefixing its versions in `chart` fields
+# and labels, e.g. 'jupyterhub-0.9.0-beta.1'.
+CHART_NAME = 'jupyterhub'
+
+# Components a hub needs before it can serve users.
+REQUIRED_COMPONENTS = ('hub', 'proxy', 'proxy-public')
+
+# Components run by a Deployment, which must finish rolling out.
+REQUIRED_DEPLOYMENTS = ('hub', 'proxy')
+
+
+def get_chart_version(chart):
+    """Get the version from a chart name-version string. Versions may
+    contain hyphens themselves, e.g. '0.9.0-beta.1'.
+    """
+    prefix = f'{CHART_NAME}-'
+    if chart.startswith(prefix):
+        return chart[len(prefix):]
+    # Another chart: its version starts at the first '-<digit>'.
+    match = re.search(r'-(\d.*)$', chart)
+    return match.group(1) if match else ''
+
+
+def get_pod_status(pod):
+    """Whether a pod is ready (or has completed), with a short detail."""
+    status = pod.get('status', {})
+    if status.get('phase') == 'Succeeded':
+        return True, 'completed'
+    for condition in status.get('conditions', []):
+        if condition['type'] == 'Ready' and condition['status'] == 'True':
+            return True, pod['metadata']['name']
+    for container in status.get('containerStatuses', []):
+        waiting = container.get('state', {}).get('waiting')
+        if waiting:
+            return False, waiting.get('reason', 'Waiting')
+    return False, status.get('phase', 'Pending')
+
+
+def get_service_status(service):
+    """Whether a load balancer service has an ingress, with its address."""
+    ingress = service.get('status', {}).get('loadBalancer', {}).get('ingress', [])
+    for entry in ingress:
+        address = entry.get('hostname') or entry.get('ip')
+        if address:
+            return True, address
+    return False, 'waiting for load balancer'
+
+
+def get_deployment_status(deployment):
+    """Whether a deployment has finished rolling out: the controller has
+    seen its latest spec, and every replica is updated and ready.
+    """
+    metadata = deployment['metadata']
+    spec = deployment.get('spec', {})
+    status = deployment.get('status', {})
+    if status.get('observedGeneration', 0) < metadata.get('generation', 0):
+        return False, 'rollout pending'
+    replicas = spec.get('replicas', 1)
+    updated = status.get('updatedReplicas', 0)
+    counts = (updated, status.get('readyReplicas', 0), status.get('replicas', 0))
+    if counts != (replicas, replicas, replicas):
+        return False, f'rolling out ({updated}/{replicas} updated)'
+    return True, metadata['name']
+
+
+def get_component_status(pods, services, deployments=None):
+    """Readiness of each hub component, from the pods, deployments and
+    load balancer services of its namespace. A component is ready once
+    all its pods are, and its deployment (if any) has rolled out; until
+    then, pods of the previous revision may still be the ready ones.
+    """
+    components = {}
+    for pod in pods.values():
+        labels = pod['metadata'].get('labels', {})
+        component = labels.get('component', pod['metadata']['name'])
+        if component == 'singleuser-server':
+            continue
+        ready, detail = get_pod_status(pod)
+        # A pod that is not ready wins; otherwise name the newest pod.
+        if components.get(component, (True, ''))[0]:
+            components[component] = (ready, detail)
+    for deployment in (deployments or {}).values():
+        labels = deployment['metadata'].get('labels', {})
+        component = labels.get('component', deployment['metadata']['name'])
+        rolled_out, detail = get_deployment_status(deployment)
+        # Keep the detail of a failing pod, e.g. ImagePullBackOff.
+        if not rolled_out and components.get(component, (True, ''))[0]:
+            components[component] = (False, detail)
+    for name, service in services.items():
+        if service.get('spec', {}).get('type') == 'LoadBalancer':
+            components[name] = get_service_status(service)
+    return components
+
 
 class Hub(Configurable):
     """Single instance of a JupyterHub deployment.
@@ -28,7 +135,7 @@ class Hub(Configurable):
 
     # Helm chart version to pull.
     version = Unicode(
-        u'0.7.0',
+        DEFAULT_CHART_VERSION,
         help='Helm Chart for Jupyterhub release.'
     ).tag(config=True)
 
@@ -41,22 +148,156 @@ class Hub(Configurable):
         help="Name of config.yaml for this Jupyterhub deployment. Updates the Helm chart."
     ).tag(config=True)
 
+    use_chart_cache = Bool(
+        True,
+        help="Install from the local chart cache instead of the remote repo."
+    ).tag(config=True)
+
+    quota = Dict(
+        help="Hard limits of the namespace's ResourceQuota, e.g. "
+             "{'requests.cpu': '20', 'limits.memory': '64Gi', 'pods': '50'}."
+    ).tag(config=True)
+
+    limit_range = Dict(
+        help="Per-container limits of the namespace's LimitRange, with "
+             "'default', 'defaultRequest', 'min' and/or 'max' keys mapping "
+             "resources to quantities, e.g. {'default': {'cpu': '1'}}."
+    ).tag(config=True)
+
+    node_pool = Unicode(
+        help="Node pool to run singleuser pods on. Nodes are matched by "
+             f"their '{NODE_POOL_LABEL}' label."
+    ).tag(config=True)
+
+    storage_class = Unicode(
+        help="Storage class of the singleuser home volumes. Defaults to "
+             "the cluster's default class."
+    ).tag(config=True)
+
+    wait = Bool(
+        False,
+        help="After deploying, wait until the hub's pods are ready and "
+             "its load balancer has an address."
+    ).tag(config=True)
+
+    wait_timeout = Float(
+        600.0,
+        help="Seconds to wait for the hub to be ready."
+    ).tag(config=True)
+
+    force_upgrade = Bool(
+        False,
+        help="Run helm upgrade even if the release is already up to date."
+    ).tag(config=True)
+
+    # Kubeconfig context of the cluster running this hub. If not
+    # given, use the current context.
+    context = Unicode(
+        help="Kubeconfig context of the cluster running this hub."
+    )
+
+    # Path to the kubeconfig holding `context`. If not given,
+    # kubectl and helm use their own defaults.
+    kubeconfig = Unicode(
+        help="Path to kubeconfig."
+    )
+
+    # Url of the hub's load balancer, once known.
+    url = Unicode(
+        help="Url of the hub."
+    )
+
+    @property
+    def kube_args(self):
+        """Arguments pointing kubectl/helm calls at this hub's cluster."""
+        return dict(context=self.context, kubeconfig=self.kubeconfig)
+
     def __init__(self, namespace, release=None, **traits):
         self.namespace = namespace
         if release is None:
             self.release = namespace
         super().__init__(**traits)
+        self.helm = Helm(config=self.config)
+        # Records what create/delete would do in dry-run mode.
+        self.plan = Plan(config=self.config)
+
+    def get_deployed_values(self):
+        """Get the values the release was last deployed with.
+
+        Returns an empty dictionary if the release is not deployed.
+        Any other failure raises, rather than passing for a new release.
+        """
+        out = self.helm.get_values(
+            self.release,
+            namespace=self.namespace,
+            output='yaml',
+            **self.kube_args
+        )
+        if is_release_not_found(out, self.release):
+            return {}
+        if out.returncode != 0:
+            raise JhubctlError(
+                f"Could not get the deployed values of {self.release}: {out.stderr}")
+        yaml = YAML()
+        data = yaml.load(out.stdout)
+        if not isinstance(data, dict):
+            return {}
+        return data
+
+    def _get_secret_token(self):
+        """Get the proxy token of this hub.
+
+        The token stored in the deployed release is reused, so
+        redeploying an unchanged hub does not restart its pods.
+        A new token is only generated for a new release.
+        """
+        try:
+            return self._secret_token
+        except AttributeError:
+            # The deployed values are unknown offline.
+            if self.plan.dry_run:
+                return placeholder(self.release, 'proxy.secretToken')
+            values = self.get_deployed_values()
+            token = (values.get('proxy') or {}).get('secretToken')
+            if not token:
+                token = secrets.token_hex(nbytes=32)
+            self._secret_token = token
+            return token
 
     def _get_security_config(self):
         """Create security YAML data."""
         # Get Token.
-        token = secrets.token_hex(nbytes=32)
+        token = self._get_secret_token()
         # Turn token into yaml
         data = {
             'proxy': {'secretToken': token}
         }
         return data
 
+    def _get_scheduling_config(self):
+        """Pin singleuser pods to this hub's node pool."""
+        data = {}
+        if self.node_pool != '':
+            data = {
+                'singleuser': {
+                    'nodeSelector': {NODE_POOL_LABEL: self.node_pool}
+                }
+            }
+        return data
+
+    def _get_storage_config(self):
+        """Provision singleuser home volumes from this hub's storage class."""
+        data = {}
+        if self.storage_class != '':
+            data = {
+                'singleuser': {
+                    'storage': {
+                        'dynamic': {'storageClass': self.storage_class}
+                    }
+                }
+            }
+        return data
+
     def _get_config_from_cli(self):
         """Get config.yaml items from CLI"""
         # NOT IMPLEMENTED YET.
@@ -77,11 +318,42 @@ class Hub(Configurable):
         """Build a config dictionary.
         """
         data = {}
-        data.update(self._get_config_from_file())
-        data.update(self._get_config_from_cli())
-        data.update(self._get_security_config())
+        # Merge in order of priority; a secretToken given in
+        # the config file wins over the stored one.
+        merge_config(data, self._get_security_config())
+        merge_config(data, self._get_scheduling_config())
+        merge_config(data, self._get_storage_config())
+        merge_config(data, self._get_config_from_file())
+        merge_config(data, self._get_config_from_cli())
         return data
 
+    def get_singleuser_config(self):
+        """Get the singleuser section of the config, without looking up
+        the deployed release.
+        """
+        data = {}
+        merge_config(data, self._get_scheduling_config())
+        merge_config(data, self._get_storage_config())
+        merge_config(data, self._get_config_from_file())
+        merge_config(data, self._get_config_from_cli())
+        return data.get('singleuser') or {}
+
+    def get_images(self):
+        """Get the singleuser images this hub's config spawns, including
+        those of its profiles.
+        """
+        singleuser = self.get_singleuser_config()
+        images = []
+        image = singleuser.get('image') or {}
+        if 'name' in image:
+            images.append(f"{image['name']}:{image.get('tag', 'latest')}")
+        for profile in singleuser.get('profileList') or []:
+            override = profile.get('kubespawner_override') or {}
+            image = override.get('image') or override.get('image_spec')
+            if image:
+                images.append(image)
+        return images
+
     def get_config_yaml(self):
         """Get config.yaml as a string.
         """
@@ -89,9 +361,50 @@ class Hub(Configurable):
         yaml = YAML()
         return yaml.dump(data)
 
+    def get_namespace_manifest(self):
+        """Get the namespace and its ResourceQuota and LimitRange, as
+        yaml. Empty if the hub sets no quota or limits.
+        """
+        if len(self.quota) == 0 and len(self.limit_range) == 0:
+            return ''
+        metadata = {'name': self.namespace}
+        documents = [{
+            'apiVersion': 'v1',
+            'kind': 'Namespace',
+            'metadata': metadata
+        }]
+        metadata = {'name': f'{self.release}-quota', 'namespace': self.namespace}
+        if len(self.quota) > 0:
+            documents.append({
+                'apiVersion': 'v1',
+                'kind': 'ResourceQuota',
+                'metadata': metadata,
+                'spec': {'hard': dict(self.quota)}
+            })
+        if len(self.limit_range) > 0:
+            documents.append({
+                'apiVersion': 'v1',
+                'kind': 'LimitRange',
+                'metadata': dict(metadata, name=f'{self.release}-limits'),
+                'spec': {'limits': [dict(self.limit_range, type='Container')]}
+            })
+        yaml = YAML()
+        return '---\n'.join(yaml.dump(document) for document in documents)
+
+    def apply_namespace_manifest(self, manifest):
+        """Create the namespace and apply its quota and limits."""
+        out = kubectl('apply', input=manifest, **self.kube_args)
+        if out.returncode != 0:
+            raise JhubctlError(out.stderr)
+        print(out.stdout)
+
     def get(self):
         """Get specific information about this hub."""
-        output = helm("get", self.release)
+        output = self.helm.get(
+            self.release,
+            namespace=self.namespace,
+            **self.kube_args
+        )
         if output.returncode != 0:
             print("Something went wrong!")
             print(output.stderr)
@@ -100,8 +413,142 @@ class Hub(Configurable):
 
     def create(self):
         """Create a single instance of notebook."""
+        # Get token to secure Jupyterhub
+        config_yaml = self.get_config_yaml()
+        namespace_manifest = self.get_namespace_manifest()
+        config_hash = self.get_config_hash(config_yaml, namespace_manifest)
+
+        if self.plan.dry_run:
+            files = {'values.yaml': config_yaml}
+            if namespace_manifest != '':
+                files['namespace.yaml'] = namespace_manifest
+            self.plan.add_step(
+                self.release,
+                f'helm upgrade --install {self.release} '
+                f'{self.helm_repo} (version {self.version}, '
+                f'namespace {self.namespace})',
+                files=files,
+                estimate=120
+            )
+            return True
+
+        # Nothing to do if the release already runs this config.
+        if self.force_upgrade is False and self.is_up_to_date(config_hash):
+            print(f"{self.release} is up to date; skipping helm upgrade.")
+            if self.wait:
+                return self.wait_until_ready()
+            return True
+
         print("Deploying a JupyterHub.")
         print("his may take a few minutes...")
+        chart = self.get_chart()
+
+        # Quotas and limits are in place before any pod starts.
+        if namespace_manifest != '':
+            self.apply_namespace_manifest(namespace_manifest)
+
+        # Get Jupyterhub.
+        out = self.helm.upgrade(
+            self.release,
+            chart,
+            namespace=self.namespace,
+            version=self.version,
+            description=f"{HASH_PREFIX}{config_hash}",
+            input=config_yaml,
+            **self.kube_args
+        )
+        if out.returncode != 0:
+            print(out.stderr)
+            return False
+        print(out.stdout)
+        if self.wait:
+            return self.wait_until_ready()
+        return True
+
+    def upgrade_chart(self):
+        """Upgrade the deployed release to `version`. Only the chart
+        changes; the release keeps the values it was deployed with,
+        whatever this Hub's config holds.
+        """
+        chart = self.get_chart()
+        out = self.helm.upgrade_chart(
+            self.release,
+            chart,
+            namespace=self.namespace,
+            version=self.version,
+            description=f"jhubctl-chart-upgrade={self.version}",
+            **self.kube_args
+        )
+        if out.returncode != 0:
+            print(out.stderr)
+            return False
+        print(out.stdout)
+        if self.wait:
+            return self.wait_until_ready()
+        return True
+
+    def wait_until_ready(self):
+        """Watch the hub's pods, deployments and services until every
+        component is ready, printing each as it becomes ready.
+
+        Right after `helm upgrade`, the pods of the previous revision
+        are still ready; the hub and proxy deployments must also have
+        rolled out.
+        """
+        print(f"Waiting for {self.release} to be ready "
+              f"(timeout {format_age(self.wait_timeout)})...")
+        start = time.time()
+        objects = {'pods': {}, 'services': {}, 'deployments': {}}
+        components, reported = {}, set()
+        watch = KubeWatch(list(objects), self.namespace, **self.kube_args)
+        watch.start()
+        try:
+            for resource, event_type, obj in watch.events(self.wait_timeout):
+                name = obj['metadata']['name']
+                if event_type == 'DELETED':
+                    objects[resource].pop(name, None)
+                else:
+                    objects[resource][name] = obj
+                components = get_component_status(
+                    objects['pods'],
+                    objects['services'],
+                    objects['deployments']
+                )
+                deployed = {
+                    d['metadata'].get('labels', {}).get('component', name)
+                    for name, d in objects['deployments'].items()
+                }
+                for component in REQUIRED_DEPLOYMENTS:
+                    if component not in deployed:
+                        components[component] = (False, 'waiting for deployment')
+                for component, (ready, detail) in components.items():
+                    if ready and component not in reported:
+                        reported.add(component)
+                        age = format_age(time.time() - start)
+                        print(f"  [ready] {component}: {detail} ({age})")
+                if all(component in components for component in REQUIRED_COMPONENTS) and \
+                        all(ready for ready, _ in components.values()):
+                    self.url = f"http://{components['proxy-public'][1]}"
+                    print(f"{self.release} is ready at {self.url}")
+                    return True
+        finally:
+            watch.stop()
+        print(f"{self.release} is not ready after {format_age(self.wait_timeout)}:")
+        for component in REQUIRED_COMPONENTS:
+            components.setdefault(component, (False, 'not created'))
+        for component, (ready, detail) in components.items():
+            if not ready:
+                print(f"  [ wait] {component}: {detail}")
+        return False
+
+    def get_chart(self):
+        """Get the chart to install: a local archive from the chart
+        cache, or the chart in the remote repo.
+        """
+        if self.use_chart_cache:
+            cache = ChartCache(helm_repo=self.helm_repo, config=self.config)
+            return str(cache.get_path(self.version))
+
         # Point to chart repo.
         out = helm(
             "repo",
@@ -110,58 +557,116 @@ class Hub(Configurable):
             self.helm_repo
         )
         out = helm("repo", "update")
+        return "jupyterhub/jupyterhub"
 
-        # Get token to secure Jupyterhub
-        config_yaml = self.get_config_yaml()
+    def get_config_hash(self, config_yaml, namespace_manifest=''):
+        """Hash identifying a chart version deployed with given values
+        (and namespace quota and limits).
+        """
+        parts = [self.helm_repo, self.version, config_yaml]
+        if namespace_manifest != '':
+            parts.append(namespace_manifest)
+        text = '\n'.join(parts)
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
 
-        # Get Jupyterhub.
-        out = helm(
-            "upgrade",
-            "--install",
+    def get_latest_revision(self):
+        """Get the latest revision of the release from helm history.
+
+        Returns None if the release does not exist.
+        """
+        out = self.helm.history(
             self.release,
-            "jupyterhub/jupyterhub",
             namespace=self.namespace,
-            version=self.version,
-            input=config_yaml
+            max='1',
+            output='json',
+            **self.kube_args
+        )
+        if out.returncode != 0 or out.stdout.strip() == '':
+            return None
+        revisions = json.loads(out.stdout)
+        if len(revisions) == 0:
+            return None
+        return revisions[-1]
+
+    def is_up_to_date(self, config_hash):
+        """Check if the release is deployed with the given config hash.
+
+        The hash is recorded in the description of every revision
+        jhubctl deploys.
+        """
+        revision = self.get_latest_revision()
+        if revision is None:
+            return False
+        deployed = revision.get('status', '').lower() == 'deployed'
+        description = revision.get('description', '')
+        return deployed and description == f"{HASH_PREFIX}{config_hash}"
+
+    def rollback(self, revision):
+        """Roll the release back to an earlier helm revision."""
+        out = self.helm.rollback(
+            self.release,
+            revision,
+            namespace=self.namespace,
+            **self.kube_args
         )
         if out.returncode != 0:
-            print(out.stderr)
-        else:
-            print(out.stdout)
+            raise JhubctlError(out.stderr)
+
+    def check_health(self, timeout=10.0):
+        """Check that the hub answers its REST API."""
+        try:
+            url = f'{self.get_url()}/hub/api'
+            with urllib.request.urlopen(url, timeout=timeout) as response:
+                return response.status == 200
+        except (JhubctlError, urllib.error.URLError, OSError):
+            return False
 
     def delete(self):
         """Delete a Jupyterhub."""
+        if self.plan.dry_run:
+            self.plan.add_step(
+                self.release,
+                f'helm delete {self.release} and namespace {self.namespace}',
+                estimate=60
+            )
+            return True
+
         # Delete the Helm Release
         print(f"Deleting {self.release}, this make take a few minutes...\n")
-        out = helm(
-            "delete",
+        out = self.helm.delete(
             self.release,
-            "--purge"
+            namespace=self.namespace,
+            **self.kube_args
         )
         if out.returncode != 0:
             print(out.stderr)
         else:
             print(out.stdout)
+        deleted = out.returncode == 0
 
         # Delete the Kubernetes namespace
         out = kubectl(
             "delete",
             "namespace",
-            self.namespace
+            self.namespace,
+            **self.kube_args
         )
         if out.returncode != 0:
             print(out.stderr)
         else:
             print(out.stdout)
+        return deleted
 
-    def _get_description_message(self):
+    def _get_description_message(self, timeout=None):
         """Get a description message."""
         # Describe cluster.
         out = kubectl(
             "describe",
             "services",
             "proxy-public",
-            namespace=self.namespace
+            namespace=self.namespace,
+            timeout=timeout,
+            **self.kube_args
         )
         return out.stdout
 
@@ -173,6 +678,8 @@ class Hub(Configurable):
 
         data = {}
         for line in lines:
+            if line.strip() == '':
+                continue
             if ":" in line:
                 idx = line.index(":")
                 key = line[:idx]
@@ -185,12 +692,21 @@ class Hub(Configurable):
                 data[key] = value
         return data
 
-    def get_description(self):
+    def get_description(self, timeout=None):
         """Get description (as dictionary)"""
-        message = self._get_description_message()
+        message = self._get_description_message(timeout=timeout)
         data = self._parse_description(message)
         return data
 
+    def get_url(self):
+        """Get the url of this hub's load balancer."""
+        if self.url == '':
+            host = self.get_description().get('LoadBalancer Ingress')
+            if not host:
+                raise JhubctlError(f"Hub {self.release} has no load balancer yet.")
+            self.url = f'http://{host}'
+        return self.url
+
     def describe(self):
         """Describe jupyterhub pod."""
         print(self._get_description_message())
@@ -1,8 +1,41 @@
+import json
+import time
+import concurrent.futures
 
-from ..utils import kubectl, helm
-from .hub import Hub
+from traitlets.config import Configurable
+from traitlets import Bool, Float, Integer, Unicode
 
-class HubList(object):
+from ..utils import kubectl, JhubctlError
+from ..helm import Helm
+from ..plan import Plan
+from ..store import format_age
+from ..bench import HubBench
+from ..watch import Watch, KubeWatch, RowDisplay
+from .hub import Hub, get_service_status, get_chart_version
+from .upgrade import HubUpgrade
+
+
+def get_service_hub(service):
+    """Describe the hub behind a proxy-public service."""
+    labels = service['metadata'].get('labels', {})
+    ready, address = get_service_status(service)
+    return {
+        'name': labels.get('release', service['metadata']['namespace']),
+        'namespace': service['metadata']['namespace'],
+        'url': address if ready else None,
+        'chart_version': get_chart_version(labels.get('chart', ''))
+    }
+
+
+def format_hub_row(hub, deleted=False):
+    """One line describing a hub, for watch mode."""
+    if deleted:
+        return f'  - {hub["name"]}: (deleted)'
+    url = hub['url'] or 'waiting for load balancer'
+    return f'  - {hub["name"]}: {url} (version {hub["chart_version"]})'
+
+
+class HubList(Configurable):
     """A class to manage many Jupyterhub deployments.
 
     Parameter
@@ -10,60 +43,396 @@ class HubList(object):
     kubeconf : KubeConf object
         A KubeConf object for managing the kubeconfig
         on the current system.
+    store : Store object
+        Local inventory that `get` answers from.
     """
-    def __init__(self, kubeconf, config):
+    all_clusters = Bool(
+        False,
+        help="List hubs across every context found in kubeconfig."
+    ).tag(config=True)
+
+    cluster_timeout = Float(
+        30.0,
+        help="Seconds to wait on a single cluster before reporting it as unreachable."
+    ).tag(config=True)
+
+    max_workers = Integer(
+        8,
+        help="Number of clusters to query concurrently."
+    ).tag(config=True)
+
+    # Kubeconfig context to run commands against. Set explicitly so
+    # that commands never depend on the current-context in kubeconfig.
+    context = Unicode(
+        help="Kubeconfig context of the cluster to manage."
+    )
+
+    def __init__(self, kubeconf, store, **traits):
         self.kubeconf = kubeconf
-        self.config = config
+        self.store = store
+        super().__init__(**traits)
+        self.helm = Helm(config=self.config)
+
+    def get_hub(self, name, context=None):
+        """Get a Hub pointed at the given (or this list's) context."""
+        if context is None:
+            context = self.context
+        return Hub(
+            namespace=name,
+            context=context,
+            kubeconfig=str(self.kubeconf.path),
+            config=self.config
+        )
 
     def create(self, name):
         """Create a jupyterhub deployment on the cluster."""
-        hub = Hub(namespace=name, config=self.config)
-        hub.create()
+        hub = self.get_hub(name)
+        created = hub.create()
+        if hub.plan.dry_run:
+            hub.plan.write()
+            hub.plan.print_summary()
+        elif created:
+            # The url is unknown until the load balancer is up,
+            # unless create waited for it.
+            self.store.put_hub(
+                hub.context,
+                hub.release,
+                namespace=hub.namespace,
+                url=hub.url or None,
+                chart_version=hub.version
+            )
+        return created
+
+    def get_releases(self, context=None, timeout=None):
+        """Get the helm releases running on a cluster.
+
+        Parameters
+        ----------
+        context : str
+            Kubeconfig context to query. If not given, use
+            this list's context.
+        timeout : float
+            Seconds to wait on helm before giving up.
 
-    def get_hubs(self):
-        """Get a list of hubs names.
-        
         Returns
         -------
-        hubs : list
-            List of hub names
+        releases : list of dict
+            Releases with `name`, `namespace` and `chart` keys.
         """
+        if context is None:
+            context = self.context
         # Use helm to get a list of hubs.
-        output = helm(
-            'list',
-            '-q'
+        output = self.helm.list(
+            output='json',
+            timeout=timeout,
+            context=context,
+            kubeconfig=self.kubeconf.path
         )
         # Check if an error occurred.
         if output.returncode != 0:
-            print("Something went wrong!")
-            print(output.stderr)
-        else:
-            hubs = output.stdout.split()
-            return hubs
+            raise JhubctlError(output.stderr)
+        # Helm prints nothing when there are no releases.
+        if output.stdout.strip() == '':
+            return []
+        data = json.loads(output.stdout)
+        if isinstance(data, dict):
+            data = data.get('Releases') or []
+        releases = []
+        for release in data:
+            # Helm 2 capitalizes keys; Helm 3 does not.
+            release = {key.lower(): value for key, value in release.items()}
+            releases.append({
+                'name': release['name'],
+                'namespace': release.get('namespace'),
+                'chart': release.get('chart', '')
+            })
+        return releases
+
+    def get_hubs(self, context=None, timeout=None):
+        """Get a list of hubs names.
+
+        Returns
+        -------
+        hubs : list
+            List of hub names
+        """
+        releases = self.get_releases(context=context, timeout=timeout)
+        return [release['name'] for release in releases]
+
+    def list_hubs(self, context=None, timeout=None):
+        """Query a cluster for its hubs, their urls and chart versions.
+
+        Returns
+        -------
+        hubs : list of dict
+            Hubs with `name`, `namespace`, `url` and `chart_version` keys.
+        """
+        hubs = []
+        for release in self.get_releases(context=context, timeout=timeout):
+            hub = self.get_hub(release['name'], context=context)
+            data = hub.get_description(timeout=timeout)
+            hubs.append({
+                'name': release['name'],
+                'namespace': release['namespace'],
+                'url': data.get('LoadBalancer Ingress'),
+                'chart_version': get_chart_version(release['chart'])
+            })
+        return hubs
+
+    def get_contexts(self):
+        """Get the names of all contexts in kubeconfig."""
+        self.kubeconf.open()
+        contexts = [c['name'] for c in self.kubeconf.get_contexts()]
+        self.kubeconf.release()
+        return contexts
+
+    def refresh(self, contexts):
+        """Query clusters for their hubs and update the store.
+
+        Clusters are queried concurrently, `max_workers` at a time. A
+        cluster that fails, or does not answer within `cluster_timeout`
+        of its query starting, is reported with its error instead of
+        stalling the others.
+
+        Returns
+        -------
+        results : dict
+            Mapping of context names to either a list of hubs
+            or the exception raised while querying that cluster.
+        """
+        results = {}
+        started = {}
+
+        def list_hubs(context):
+            started[context] = time.monotonic()
+            return self.list_hubs(context=context, timeout=self.cluster_timeout)
+
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_workers
+        )
+        futures = {
+            executor.submit(list_hubs, context): context
+            for context in contexts
+        }
+        pending = set(futures)
+        while pending:
+            # Wake at the next deadline, or within a second to see
+            # queued queries start.
+            now = time.monotonic()
+            deadlines = [
+                started[futures[f]] + self.cluster_timeout
+                for f in pending if futures[f] in started
+            ]
+            timeout = max(0, min(deadlines + [now + 1.0]) - now)
+            done, pending = concurrent.futures.wait(
+                pending,
+                timeout=timeout,
+                return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                context = futures[future]
+                try:
+                    results[context] = future.result()
+                except Exception as e:
+                    results[context] = e
+                else:
+                    self.store.put_hubs(context, results[context])
+            now = time.monotonic()
+            for future in list(pending):
+                context = futures[future]
+                if context in started and now - started[context] >= self.cluster_timeout:
+                    pending.discard(future)
+                    results[context] = JhubctlError(
+                        f"Timed out after {self.cluster_timeout} seconds.")
+        # Nothing should be queued by now; cancel anything that is, so
+        # the interpreter does not wait for it on exit. Subprocess
+        # timeouts bound the calls that are still running.
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+        return results
+
+    def get_listings(self, contexts):
+        """Get the hubs of each context, from the store when possible.
+
+        Contexts missing from the store, or all of them when the store's
+        `refresh` option is set, are queried live. Stale entries are
+        returned as is and refreshed in the background.
+
+        Returns
+        -------
+        listings : dict
+            Mapping of context names to (hubs, updated) tuples, where hubs
+            is either a list of hubs or the exception raised while
+            querying that cluster.
+        """
+        listings = {}
+        missing = []
+        for context in contexts:
+            hubs, updated = None, None
+            if self.store.refresh is False:
+                hubs, updated = self.store.get_hubs(context)
+            if hubs is None:
+                missing.append(context)
+                continue
+            listings[context] = (hubs, updated)
+            if self.store.is_stale(updated):
+                self.store.spawn_refresh(
+                    'get',
+                    'hub',
+                    f'--context={context}',
+                    f'--kubeconfig={self.kubeconf.path}',
+                    f'--Helm.version={self.helm.version}'
+                )
+        now = time.time()
+        for context, hubs in self.refresh(missing).items():
+            listings[context] = (hubs, now)
+        # Keep the kubeconfig order.
+        return {context: listings[context] for context in contexts}
+
+    def _format_updated(self, updated):
+        """Staleness indicator for a listing."""
+        message = f"{format_age(time.time() - updated)} ago"
+        if self.store.is_stale(updated):
+            message += " (stale, refreshing)"
+        return message
+
+    def watch(self):
+        """Print the hubs of this list's cluster, then redraw them as their
+        proxy-public services change, until interrupted.
+
+        A single watch on the services replaces polling helm and kubectl
+        per hub; the changes are also written to the store.
+        """
+        hubs, updated = self.get_listings([self.context])[self.context]
+        if isinstance(hubs, Exception):
+            raise hubs
+        print(f"Running Jupyterhub Deployments in {self.context} (Ctrl-C to stop):")
+        display = RowDisplay()
+        for hub in hubs:
+            display.update(hub['name'], format_hub_row(hub))
+        watch = KubeWatch(
+            ['services'],
+            selector='component=proxy-public',
+            context=self.context,
+            kubeconfig=self.kubeconf.path
+        )
+        watch.start()
+        try:
+            for _, event_type, service in watch.events():
+                hub = get_service_hub(service)
+                if event_type == 'DELETED':
+                    self.store.delete_hub(self.context, hub['name'])
+                    display.update(hub['name'], format_hub_row(hub, deleted=True))
+                    continue
+                self.store.put_hub(
+                    self.context,
+                    hub['name'],
+                    namespace=hub['namespace'],
+                    url=hub['url'],
+                    chart_version=hub['chart_version']
+                )
+                display.update(hub['name'], format_hub_row(hub))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watch.stop()
 
     def get(self, name=None):
         """Print a list of all jupyterHubs."""
+        if Watch(config=self.config).enabled:
+            if name is not None or self.all_clusters:
+                raise JhubctlError("--watch lists the hubs of a single cluster.")
+            return self.watch()
+        if name is not None:
+            hub = self.get_hub(name)
+            hub.get()
+        # Print a list of hubs across clusters.
+        elif self.all_clusters:
+            listings = self.get_listings(self.get_contexts())
+            print("Running Jupyterhub Deployments (by cluster):")
+            for context, (hubs, updated) in listings.items():
+                print(f'  - Cluster: {context}')
+                if isinstance(hubs, Exception):
+                    print(f'    Error: {hubs}'.rstrip())
+                    continue
+                print(f'    Updated: {self._format_updated(updated)}')
+                print('    Hubs:')
+                for hub in hubs:
+                    print(f'      - Name: {hub["name"]}')
+                    print(f'        Url: {hub["url"]}')
+                    print(f'        Version: {hub["chart_version"]}')
         # Print a list of hubs.
-        if name is None:
-            hubs = self.get_hubs()
-            print("Running Jupyterhub Deployments (by name):")
-            for hub_name in hubs:
-                hub = Hub(namespace=hub_name, config=self.config)
-                data = hub.get_description()
-                url = data['LoadBalancer Ingress']
-                print(f'  - Name: {hub_name}')
-                print(f'    Url: {url}')
         else:
-            hub = Hub(namespace=name, config=self.config)
-            hub.get()
-        
+            listings = self.get_listings([self.context])
+            hubs, updated = listings[self.context]
+            if isinstance(hubs, Exception):
+                raise hubs
+            print("Running Jupyterhub Deployments (by name):")
+            for hub in hubs:
+                print(f'  - Name: {hub["name"]}')
+                print(f'    Url: {hub["url"]}')
+                print(f'    Version: {hub["chart_version"]}')
+            print(f'(updated {self._format_updated(updated)})')
+
     def delete(self, name):
         """Delete Hub from Kubernetes Cluster
         """
-        hub = Hub(namespace=name, config=self.config)
-        hub.delete()
+        hub = self.get_hub(name)
+        deleted = hub.delete()
+        if hub.plan.dry_run:
+            hub.plan.write()
+            hub.plan.print_summary()
+        elif deleted:
+            self.store.delete_hub(hub.context, hub.release)
+        return deleted
 
     def describe(self, name):
         """Describe a cluster."""
-        hub = Hub(namespace=name, config=self.config)
+        hub = self.get_hub(name)
         hub.describe()
+
+    def bench(self, name):
+        """Load test spawning servers on a hub."""
+        hub = self.get_hub(name)
+        bench = HubBench(config=self.config)
+        return bench.start(name, hub.get_url)
+
+    def upgrade(self, name=None):
+        """Upgrade a hub, or all hubs of the cluster, to `Hub.version`."""
+        upgrade = HubUpgrade(config=self.config)
+        if 'version' not in self.config.Hub:
+            raise JhubctlError("Give the chart version to upgrade to with --version.")
+        if name is None and not upgrade.all:
+            raise JhubctlError("Name a hub to upgrade, or upgrade them all with --all.")
+        releases = self.get_releases()
+        hubs = {}
+        for release in releases:
+            if name is not None and release['name'] != name:
+                continue
+            hub = self.get_hub(release['name'])
+            if get_chart_version(release['chart']) == hub.version:
+                print(f"{hub.release} already runs {hub.version}.")
+                continue
+            hubs[hub.release] = hub
+        if name is not None and name not in hubs and name not in [r['name'] for r in releases]:
+            raise JhubctlError(f"Hub {name} not found.")
+        if len(hubs) == 0:
+            return True
+        if Plan(config=self.config).dry_run:
+            for number, batch in enumerate(upgrade.get_batches(list(hubs)), start=1):
+                print(f"Batch {number}: {', '.join(batch)}")
+            print("Dry run; nothing was upgraded.")
+            return True
+        results = upgrade.start(hubs, Hub(namespace='', config=self.config).version)
+        for hub_name, ok in results.items():
+            if ok:
+                hub = hubs[hub_name]
+                self.store.put_hub(
+                    hub.context,
+                    hub.release,
+                    namespace=hub.namespace,
+                    url=hub.url or None,
+                    chart_version=hub.version
+                )
+        return all(results.values()) and len(results) == len(hubs)
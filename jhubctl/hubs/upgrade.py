@@ -0,0 +1,158 @@
+import sys
+import time
+import concurrent.futures
+
+from traitlets.config import Configurable
+from traitlets import Bool, Integer, List, Unicode
+
+from ..utils import ThreadOutput
+from ..store import format_age
+
+
+class HubUpgrade(Configurable):
+    """Rolling upgrade of many hubs to a new chart version.
+
+    Canary hubs are upgraded first, on their own; the others follow in
+    batches. Every hub of a batch must become ready (and answer its
+    REST API) before the next batch starts. Failed hubs are rolled
+    back if `rollback` is set, and once more than `max_failures` hubs
+    have failed, the upgrade stops.
+    """
+    all = Bool(
+        False,
+        help="Upgrade every hub of the cluster."
+    ).tag(config=True)
+
+    canaries = List(
+        Unicode(),
+        help="Hubs to upgrade first, on their own. Defaults to the "
+             "first `canary_count` hubs."
+    ).tag(config=True)
+
+    canary_count = Integer(
+        1,
+        help="Number of canary hubs, if `canaries` is not given."
+    ).tag(config=True)
+
+    batch_size = Integer(
+        10,
+        help="Number of hubs in each batch after the canaries."
+    ).tag(config=True)
+
+    concurrency = Integer(
+        4,
+        help="Number of hubs of a batch upgraded at the same time."
+    ).tag(config=True)
+
+    max_failures = Integer(
+        0,
+        help="Number of failed hubs tolerated before the upgrade stops."
+    ).tag(config=True)
+
+    rollback = Bool(
+        False,
+        help="Roll failed hubs back to the revision they ran before."
+    ).tag(config=True)
+
+    health_check = Bool(
+        True,
+        help="Check that upgraded hubs answer their REST API."
+    ).tag(config=True)
+
+    def get_batches(self, names):
+        """Split hub names into a canary batch and batches of `batch_size`."""
+        canaries = [name for name in self.canaries if name in names]
+        if len(canaries) == 0:
+            canaries = names[:self.canary_count]
+        others = [name for name in names if name not in canaries]
+        batches = [canaries] if len(canaries) > 0 else []
+        for i in range(0, len(others), self.batch_size):
+            batches.append(others[i:i + self.batch_size])
+        return batches
+
+    def upgrade_hub(self, hub, output):
+        """Upgrade a hub's chart, keeping its deployed values, and wait
+        until it has rolled out and is healthy.
+
+        Returns
+        -------
+        ok : bool
+        message : str
+            How long the upgrade took, or why it failed.
+        revision : dict or None
+            Helm revision the hub ran before.
+        """
+        start = time.time()
+        revision = hub.get_latest_revision()
+        hub.wait = True
+        with output.capture() as buffer:
+            try:
+                ok = hub.upgrade_chart()
+            except Exception as e:
+                print(f'{type(e).__name__}: {e}')
+                ok = False
+        if not ok:
+            lines = [line for line in buffer.getvalue().splitlines() if line.strip()]
+            return False, lines[-1].strip() if lines else 'upgrade failed', revision
+        if self.health_check and not hub.check_health():
+            return False, f'{hub.url}/hub/api did not answer', revision
+        return True, format_age(time.time() - start), revision
+
+    def roll_back(self, hub, revision):
+        """Roll a failed hub back, reporting the outcome."""
+        if revision is None:
+            print(f"  [skip] {hub.release}: nothing to roll back to")
+            return
+        try:
+            hub.rollback(revision['revision'])
+            print(f"  [back] {hub.release}: revision {revision['revision']}")
+        except Exception as e:
+            print(f"  [fail] {hub.release}: rollback failed: {e}")
+
+    def start(self, hubs, version):
+        """Upgrade hubs (mapping names to Hub objects) in batches.
+
+        Returns
+        -------
+        results : dict
+            Mapping of each attempted hub name to whether it succeeded.
+        """
+        batches = self.get_batches(list(hubs))
+        print(f"Upgrading {len(hubs)} hub(s) to {version} in {len(batches)} "
+              f"batch(es), {self.concurrency} at a time.")
+        output = ThreadOutput(sys.stdout)
+        sys.stdout = output
+        results = {}
+        failures = 0
+        try:
+            for number, batch in enumerate(batches, start=1):
+                canary = number == 1 and (len(self.canaries) > 0 or self.canary_count > 0)
+                label = ' (canary)' if canary else ''
+                print(f"Batch {number}/{len(batches)}{label}: {', '.join(batch)}")
+                with concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                    futures = {
+                        executor.submit(self.upgrade_hub, hubs[name], output): name
+                        for name in batch
+                    }
+                    failed = []
+                    for future in concurrent.futures.as_completed(futures):
+                        name = futures[future]
+                        ok, message, revision = future.result()
+                        results[name] = ok
+                        print(f"  [{'  ok' if ok else 'fail'}] {name}: {message}")
+                        if not ok:
+                            failed.append((name, revision))
+                if self.rollback:
+                    for name, revision in failed:
+                        self.roll_back(hubs[name], revision)
+                failures += len(failed)
+                if failures > self.max_failures:
+                    print(f"Stopping: {failures} hub(s) failed "
+                          f"(--HubUpgrade.max_failures={self.max_failures}).")
+                    break
+        finally:
+            sys.stdout = output.stream
+        upgraded = sum(results.values())
+        print(f"Upgraded {upgraded}/{len(hubs)} hub(s); {failures} failed; "
+              f"{len(hubs) - len(results)} not started.")
+        return results
@@ -0,0 +1,285 @@
+import os
+import copy
+import tempfile
+import threading
+import contextlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import yaml
+import kubeconf
+from kubeconf.kubeconf import KubeConfError
+
+# Prefer the libyaml bindings; kubeconfigs with hundreds of
+# entries are slow to parse in pure python.
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+SafeDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+
+class KubeConf(kubeconf.KubeConf):
+    """Kubeconfig file guarded by an advisory file lock and
+    indexed in memory.
+
+    `open` takes an exclusive lock on `<path>.lock` and holds it
+    until `close` (or `release`) is called, so two jhubctl processes
+    cannot interleave their read-modify-write of the same kubeconfig.
+    Locking is skipped on platforms without `fcntl`. Within a process,
+    the kubeconfig is open for one thread at a time.
+
+    The file is parsed once and reused until it changes on disk.
+    Clusters, users and contexts are indexed by name, and `close`
+    only rewrites the file (atomically) when the data changed, so
+    any number of entries can be added or removed in one write.
+    """
+    _lock_file = None
+
+    # Thread that currently has the kubeconfig open.
+    _owner = None
+
+    # Kubeconfig sections indexed by name.
+    sections = ('clusters', 'users', 'contexts')
+
+    def __init__(self, **traits):
+        self._thread_lock = threading.Lock()
+        super().__init__(**traits)
+
+    @property
+    def lock_path(self):
+        """Path of the lock file sitting next to the kubeconfig."""
+        return self.path.with_name(self.path.name + '.lock')
+
+    def _acquire(self, mode):
+        """Take a lock on the kubeconfig. Returns the open lock file."""
+        self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+        lock_file = open(self.lock_path, 'a')
+        if fcntl is not None:
+            fcntl.flock(lock_file, mode)
+        return lock_file
+
+    def _release(self, lock_file):
+        """Release a lock taken by `_acquire`."""
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+    @contextlib.contextmanager
+    def _shared_lock(self):
+        """Lock the kubeconfig for reading, unless this object
+        already holds the exclusive lock.
+        """
+        if self._lock_file is not None:
+            yield
+            return
+        lock_file = self._acquire(fcntl.LOCK_SH if fcntl else None)
+        try:
+            yield
+        finally:
+            self._release(lock_file)
+
+    # --------------- File I/O ------------------
+
+    def _parse(self):
+        """Parse the kubeconfig file, reusing the last parse if the
+        file has not changed since.
+        """
+        stat = self.path.stat()
+        key = (stat.st_mtime_ns, stat.st_size)
+        if getattr(self, '_parsed_key', None) != key:
+            stream = self.path.read_text()
+            self._parsed = yaml.load(stream, Loader=SafeLoader) or {}
+            self._parsed_key = key
+        return self._parsed
+
+    def _read(self):
+        """Read the kube config file."""
+        # Hand out a copy; the cached parse must stay pristine.
+        return copy.deepcopy(self._parse())
+
+    def _write(self, data):
+        """Atomically replace the config file with data."""
+        stream = yaml.dump(data, Dumper=SafeDumper, default_flow_style=False)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(
+            dir=str(self.path.parent),
+            prefix=f'.{self.path.name}.'
+        )
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(stream)
+            if self.path.exists():
+                os.chmod(tmp_path, self.path.stat().st_mode)
+            os.replace(tmp_path, str(self.path))
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    def _index(self):
+        """Index clusters, users and contexts by name."""
+        self._indexes = {}
+        for section in self.sections:
+            self._indexes[section] = {
+                entry['name']: entry for entry in self.data[section]
+            }
+
+    def open(self, create_if_not_found=True):
+        """Lock and open the kubeconfig file. The lock is held
+        until `close` or `release` is called.
+
+        Opening an already open kubeconfig is a no-op. Other threads
+        wait until it is closed.
+        """
+        if self._owner == threading.get_ident():
+            return self
+        self._thread_lock.acquire()
+        self._owner = threading.get_ident()
+        if self._lock_file is None:
+            self._lock_file = self._acquire(fcntl.LOCK_EX if fcntl else None)
+        try:
+            self.data = self._read()
+        except FileNotFoundError:
+            if create_if_not_found is not True:
+                self.release()
+                raise
+            self.data = {}
+        except Exception:
+            self.release()
+            raise
+
+        # Enforce the following keys exists in data.
+        for section in self.sections:
+            if not self.data.get(section):
+                self.data[section] = []
+        self.data.setdefault('apiVersion', 'v1')
+        self.data.setdefault('kind', 'Config')
+        self.data.setdefault('preferences', {})
+        self.data.setdefault('current-context', '')
+
+        # Only write back on close if something changed.
+        self._snapshot = copy.deepcopy(self.data)
+        self._index()
+        return self
+
+    def close(self):
+        """Commit any changes to the file and release the lock."""
+        try:
+            if self.data != self._snapshot:
+                self._write(self.data)
+            delattr(self, '_data')
+        finally:
+            self._unlock()
+        return self
+
+    def release(self):
+        """Drop any changes and release the lock without writing."""
+        if self._owner != threading.get_ident():
+            return self
+        if hasattr(self, '_data'):
+            delattr(self, '_data')
+        self._unlock()
+        return self
+
+    def _unlock(self):
+        if self._lock_file is not None:
+            self._release(self._lock_file)
+            self._lock_file = None
+        if self._owner == threading.get_ident():
+            self._owner = None
+            self._thread_lock.release()
+
+    def get_current_context(self):
+        """Get the current context found in kubeconfig."""
+        if self._owner == threading.get_ident():
+            return self.data['current-context']
+        with self._shared_lock():
+            return self._parse().get('current-context', '')
+
+    # --------------- Indexed lookups ------------------
+
+    def _exists(self, section, name):
+        return name in self._indexes[section]
+
+    def _get(self, section, name):
+        try:
+            return self._indexes[section][name]
+        except KeyError:
+            raise KubeConfError(f"{section[:-1]} name not found.")
+
+    def _remove(self, section, names):
+        """Remove many entries from a section in a single pass."""
+        names = set(names)
+        missing = names - set(self._indexes[section])
+        if missing:
+            raise KubeConfError(
+                f"{section[:-1]} name not found: {', '.join(sorted(missing))}")
+        self.data[section][:] = [
+            entry for entry in self.data[section]
+            if entry['name'] not in names
+        ]
+        for name in names:
+            del self._indexes[section][name]
+
+    def cluster_exists(self, name):
+        """Check if a given cluster exists."""
+        return self._exists('clusters', name)
+
+    def get_cluster(self, name):
+        """Get cluster from kubeconfig."""
+        return self._get('clusters', name)
+
+    def add_cluster(self, name, **attrs):
+        """Add a cluster to config."""
+        super().add_cluster(name, **attrs)
+        self._indexes['clusters'][name] = self.data['clusters'][-1]
+
+    def remove_cluster(self, name):
+        """Remove a cluster from kubeconfig."""
+        self._remove('clusters', [name])
+
+    def remove_clusters(self, *names):
+        """Remove many clusters from kubeconfig."""
+        self._remove('clusters', names)
+
+    def user_exists(self, name):
+        """Check if a given user exists."""
+        return self._exists('users', name)
+
+    def get_user(self, name):
+        """Get user from kubeconfig."""
+        return self._get('users', name)
+
+    def add_user(self, name, **attrs):
+        """Add a user to config."""
+        super().add_user(name, **attrs)
+        self._indexes['users'][name] = self.data['users'][-1]
+
+    def remove_user(self, name):
+        """Remove a user from kubeconfig."""
+        self._remove('users', [name])
+
+    def remove_users(self, *names):
+        """Remove many users from kubeconfig."""
+        self._remove('users', names)
+
+    def context_exists(self, name):
+        """Check if a given context exists."""
+        return self._exists('contexts', name)
+
+    def get_context(self, name):
+        """Get context from kubeconfig."""
+        return self._get('contexts', name)
+
+    def add_context(self, name, **attrs):
+        """Add a context to config."""
+        super().add_context(name, **attrs)
+        self._indexes['contexts'][name] = self.data['contexts'][-1]
+
+    def remove_context(self, name):
+        """Remove a context from kubeconfig."""
+        self._remove('contexts', [name])
+
+    def remove_contexts(self, *names):
+        """Remove many contexts from kubeconfig."""
+        self._remove('contexts', names)
@@ -23,11 +23,18 @@ from traitlets import (
     Dict
 )
 
-from kubeconf import KubeConf
-
+from .kubeconfig import KubeConf
+from .store import Store
+from .charts import ChartCache
+from .helm import Helm
+from .plan import Plan
+from .bench import HubBench
+from .capacity import CapacityPlanner
+from .watch import Watch
+from .server import JhubctlServer
 from .utils import JhubctlError
 from .clusters import providers, ClusterList
-from .hubs import HubList, Hub
+from .hubs import HubList, Hub, HubUpgrade
 
 
 def exception_handler(exception_type, exception, traceback):
@@ -52,6 +59,9 @@ class JhubctlApp(Application):
         $ jhubctl get <resource> : List all resources found in kubeconfig.
         $ jhubctl create <resource> <name> : Create a resource with the given name.
         $ jhubctl delete <resource> <name> : Delete a resource with the given name.
+        $ jhubctl bench hub <name> : Load test spawning servers on a hub.
+        $ jhubctl upgrade hub --all --version <version> : Upgrade every hub in batches.
+        $ jhubctl plan capacity : Estimate the users a cluster can hold, offline.
     
 
     JhubctlApp is configurable through traitlets config system. Configurable traits
@@ -77,27 +87,91 @@ class JhubctlApp(Application):
     # Classes to expose to the config system
     classes = List([
         KubeConf,
-        Hub
+        Hub,
+        HubList,
+        HubUpgrade,
+        Store,
+        Helm,
+        Plan,
+        HubBench,
+        CapacityPlanner,
+        Watch,
+        ChartCache,
+        JhubctlServer
     ])
 
+    # Flags exposed on the command line.
+    flags = Dict({
+        'all': (
+            {'HubUpgrade': {'all': True}},
+            "Upgrade every hub of the cluster."
+        ),
+        'all-clusters': (
+            {'HubList': {'all_clusters': True}},
+            "List hubs across every context found in kubeconfig."
+        ),
+        'dry-run': (
+            {'Plan': {'dry_run': True}},
+            "Write what create/delete would do to a plan directory instead of doing it."
+        ),
+        'force-upgrade': (
+            {'Hub': {'force_upgrade': True}},
+            "Run helm upgrade even if the hub is already up to date."
+        ),
+        'watch': (
+            {'Watch': {'enabled': True}},
+            "Keep listing, redrawing the hubs or clusters that change."
+        ),
+        'wait': (
+            {'Hub': {'wait': True}},
+            "Wait until a created hub is ready, up to --Hub.wait_timeout seconds."
+        ),
+        'refresh': (
+            {'Store': {'refresh': True}},
+            "Query clusters directly instead of answering from the local state."
+        ),
+    })
+
+    # Command line aliases.
+    aliases = Dict({
+        'context': 'JhubctlApp.context',
+        'kubeconfig': 'KubeConf.path',
+        'helm-version': 'Helm.version',
+        'plan-dir': 'Plan.output_dir',
+        'version': 'Hub.version',
+    })
+
     # Provider to configure.
     provider_type = Unicode(
         u'AwsEKS',
         help="Provider type."
     ).tag(config=True)
     
+    # Kubeconfig context that commands run against.
+    context = Unicode(
+        help="Kubeconfig context to run commands against. "
+             "Defaults to the current-context in kubeconfig."
+    ).tag(config=True)
+
     # Subcommands allowed by application.
     subcommands = Dict({
         'create': ((), 'Create a resource.'),
         'delete': ((), 'Delete a resource.'),
         'get': ((), 'List a resource or resources'),
-        'describe': ((), 'Describe a resource')
+        'describe': ((), 'Describe a resource'),
+        'cache': ((), 'Download a resource ahead of time.'),
+        'bench': ((), 'Load test a resource.'),
+        'upgrade': ((), 'Upgrade a resource, or all of them, to a new version.'),
+        'plan': ((), 'Estimate the capacity of a resource, offline.'),
+        'serve': ((), 'Serve jhubctl actions over a local HTTP API.')
     })
 
     # Resource that can be deployed and managed.
     resources = List([
         'cluster',
         'hub',
+        'charts',
+        'capacity',
     ])
 
     # Name of the configuration file to read.
@@ -145,7 +219,10 @@ class JhubctlApp(Application):
             self.print_help('--help-all' in self.argv)
             self.exit(0)
 
-        if '--version' in self.argv or '-V' in self.argv:
+        # After a subcommand, e.g. `upgrade hub --version X`, --version
+        # names a chart version (`Hub.version`).
+        subcommand = len(self.argv) > 0 and self.argv[0] in self.subcommands
+        if not subcommand and ('--version' in self.argv or '-V' in self.argv):
             self.print_version()
             self.exit(0)
 
@@ -159,7 +236,7 @@ class JhubctlApp(Application):
         # If not config, parse commands.
         ## Run sanity checks.
         # Check that the minimum number of arguments have been called.
-        if len(self.argv) < 2:
+        if len(self.argv) < 2 and self.argv[:1] != ['serve']:
             raise JhubctlError(
                 "Not enough arguments. \n\n"
                 "Expected: jhubctl <action> <resource> <name>")
@@ -170,6 +247,25 @@ class JhubctlApp(Application):
             raise JhubctlError(
                 f"Subcommand is not recognized; must be one of these: {self.subcommands}")
 
+        # The server manages every resource.
+        if self.resource_action == 'serve':
+            self.resource_type = None
+            self.resource_name = None
+        else:
+            self._parse_resource()
+
+        # flatten flags&aliases, so cl-args get appropriate priority:
+        flags, aliases = self.flatten_flags()
+        loader = KVArgParseConfigLoader(argv=argv, aliases=aliases,
+                                        flags=flags, log=self.log)
+        config = loader.load_config()
+        self.update_config(config)
+        # store unparsed args in extra_args
+        self.extra_args = loader.extra_args
+
+
+    def _parse_resource(self):
+        """Parse the resource type and name following the subcommand."""
         # Check resource
         self.resource_type = self.argv[1]
         if self.resource_type not in self.resources:
@@ -177,28 +273,24 @@ class JhubctlApp(Application):
                 f"First argument after a subcommand must one of these"
                 f"resources: {self.resources}"
             )
+        # Capacity is only planned, and planning only applies to capacity.
+        if (self.resource_action == 'plan') != (self.resource_type == 'capacity'):
+            raise JhubctlError(
+                f"Cannot {self.resource_action} resource: {self.resource_type}")
 
         # Get name of resource.
         try:
             self.resource_name = self.argv[2]
+            if self.resource_name.startswith('-'):
+                raise IndexError
         except IndexError:
-            if self.resource_action != "get":
+            if self.resource_action not in ("get", "cache", "upgrade", "plan"):
                 raise JhubctlError(
                     "Not enough arguments. \n\n"
                     "Expected: jhubctl <action> <resource> <name>")
             else:
                 self.resource_name = None
 
-        # flatten flags&aliases, so cl-args get appropriate priority:
-        flags, aliases = self.flatten_flags()
-        loader = KVArgParseConfigLoader(argv=argv, aliases=aliases,
-                                        flags=flags, log=self.log)
-        config = loader.load_config()
-        self.update_config(config)
-        # store unparsed args in extra_args
-        self.extra_args = loader.extra_args
-
-
     def initialize(self, argv=None):
         """Handle specific configurations."""
         # Parse configuration items on command line.
@@ -206,16 +298,51 @@ class JhubctlApp(Application):
         if self.config_file:
             self.load_config_file(self.config_file)
 
+        # Capacity planning is offline; it needs neither kubeconfig
+        # nor the local state.
+        if self.resource_action == 'plan':
+            self.capacity_list = CapacityPlanner(config=self.config)
+            return
+
         # Initialize objects to interact with.
-        self.kubeconf = KubeConf()
-        self.cluster_list = ClusterList(kubeconf=self.kubeconf, config=self.config)
-        self.hub_list = HubList(kubeconf=self.kubeconf, config=self.config)
+        self.kubeconf = KubeConf(config=self.config)
+
+        # Resolve the context once so that every call made by this
+        # command targets the same cluster, even if another process
+        # changes the current-context meanwhile.
+        context = self.context or self.kubeconf.get_current_context()
+        self.store = Store(config=self.config)
+        self.cluster_list = ClusterList(
+            kubeconf=self.kubeconf,
+            store=self.store,
+            config=self.config
+        )
+        self.hub_list = HubList(
+            kubeconf=self.kubeconf,
+            store=self.store,
+            context=context,
+            config=self.config
+        )
+        self.charts_list = ChartCache(config=self.config)
+        if self.resource_action == 'serve':
+            self.server = JhubctlServer(
+                kubeconf=self.kubeconf,
+                store=self.store,
+                context=context,
+                config=self.config
+            )
 
     def start(self):
         """Execution happening on jhubctl."""
+        if self.resource_action == 'serve':
+            self.server.start()
+            return
         # Get specified resource.
-        resource_list = getattr(self, f'{self.resource_type}_list')
-        resource_action = getattr(resource_list, self.resource_action)
+        resource_list = getattr(self, f'{self.resource_type}_list', None)
+        resource_action = getattr(resource_list, self.resource_action, None)
+        if resource_action is None:
+            raise JhubctlError(
+                f"Cannot {self.resource_action} resource: {self.resource_type}")
         resource_action(self.resource_name)
 
 
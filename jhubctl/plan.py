@@ -0,0 +1,138 @@
+import re
+import json
+import pathlib
+
+from traitlets.config import Configurable
+from traitlets import Unicode, Bool
+
+from .store import format_age
+
+
+# Placeholders look like `<ref:source.key>`.
+PLACEHOLDER = re.compile(r'<ref:([^.>]+)\.([^>]+)>')
+
+
+def placeholder(source, key):
+    """Stand-in for a value only known once `source` exists, e.g.
+    the output of another stack.
+    """
+    return f'<ref:{source}.{key}>'
+
+
+class Plan(Configurable):
+    """Offline record of what an action would do.
+
+    In dry-run mode, actions add a step for each stack, manifest or
+    release they would create instead of creating it. Values that are
+    only known once another step has run are rendered as placeholders,
+    and a step depends on every step its placeholders refer to.
+    `write` renders the steps into `output_dir`.
+    """
+    dry_run = Bool(
+        False,
+        help="Render what an action would create instead of running it."
+    ).tag(config=True)
+
+    output_dir = Unicode(
+        u'jhubctl-plan',
+        help="Directory the dry-run plan is written to."
+    ).tag(config=True)
+
+    def __init__(self, **traits):
+        super().__init__(**traits)
+        self.steps = []
+
+    def add_step(self, name, action, files=None, depends_on=None, estimate=0):
+        """Add a step to the plan.
+
+        Parameters
+        ----------
+        name : str
+            Name of the step, e.g. a stack name.
+        action : str
+            What the step does.
+        files : dict
+            Mapping of file names to the content rendered for this step.
+        depends_on : list
+            Steps that must finish before this one, in addition to those
+            referred to by placeholders in `files`.
+        estimate : float
+            Estimated duration of the step in seconds.
+        """
+        files = files or {}
+        names = [step['name'] for step in self.steps]
+        depends_on = list(depends_on or [])
+        for text in files.values():
+            for source, key in PLACEHOLDER.findall(text):
+                if source in names and source not in depends_on:
+                    depends_on.append(source)
+        self.steps.append({
+            'name': name,
+            'action': action,
+            'files': files,
+            'depends_on': [d for d in depends_on if d in names],
+            'estimate': estimate
+        })
+
+    def get_finish_times(self):
+        """Earliest finish time of each step if independent steps ran
+        concurrently.
+        """
+        finish = {}
+        for step in self.steps:
+            start = max([finish[d] for d in step['depends_on']], default=0)
+            finish[step['name']] = start + step['estimate']
+        return finish
+
+    def get_critical_path(self):
+        """Steps on the longest chain of dependencies."""
+        finish = self.get_finish_times()
+        if len(finish) == 0:
+            return []
+        steps = {step['name']: step for step in self.steps}
+        name = max(finish, key=finish.get)
+        path = [name]
+        while steps[name]['depends_on']:
+            name = max(steps[name]['depends_on'], key=finish.get)
+            path.insert(0, name)
+        return path
+
+    def write(self):
+        """Write every step's files and a `plan.json` summary."""
+        output_dir = pathlib.Path(self.output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        summary = []
+        for i, step in enumerate(self.steps, start=1):
+            step_dir = output_dir.joinpath(f"{i:02d}-{step['name']}")
+            if step['files']:
+                step_dir.mkdir(exist_ok=True)
+            for filename, text in step['files'].items():
+                step_dir.joinpath(filename).write_text(text)
+            summary.append({
+                'name': step['name'],
+                'action': step['action'],
+                'files': [str(step_dir.joinpath(f)) for f in step['files']],
+                'depends_on': step['depends_on'],
+                'estimate': step['estimate']
+            })
+        finish = self.get_finish_times()
+        output_dir.joinpath('plan.json').write_text(json.dumps({
+            'steps': summary,
+            'critical_path': self.get_critical_path(),
+            'estimate': max(finish.values(), default=0)
+        }, indent=2))
+
+    def print_summary(self):
+        """Print the steps in order, with an estimated duration."""
+        print(f"Dry run; nothing was changed. Plan written to {self.output_dir}")
+        print("Steps:")
+        for i, step in enumerate(self.steps, start=1):
+            print(f"  {i:2d}. {step['name']}: {step['action']} "
+                  f"(~{format_age(step['estimate'])})")
+            if step['depends_on']:
+                print(f"      after: {', '.join(step['depends_on'])}")
+        finish = self.get_finish_times()
+        sequential = sum(step['estimate'] for step in self.steps)
+        print(f"Estimated duration: ~{format_age(sequential)} sequential, "
+              f"~{format_age(max(finish.values(), default=0))} critical path")
+        print(f"Critical path: {' -> '.join(self.get_critical_path())}")
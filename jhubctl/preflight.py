@@ -0,0 +1,60 @@
+import concurrent.futures
+
+from .utils import JhubctlError
+
+
+class PreflightWarning(Exception):
+    """Raised by a check that found something worth reporting, but
+    that should not stop the action.
+    """
+
+
+def run_checks(checks, max_workers=8):
+    """Run pre-flight checks concurrently.
+
+    Parameters
+    ----------
+    checks : list of tuple
+        (description, callable) pairs. A check passes by returning
+        (optionally with a detail message), warns by raising
+        PreflightWarning, and fails by raising anything else.
+
+    Returns
+    -------
+    results : list of tuple
+        (description, status, message) in the order of `checks`, where
+        status is 'ok', 'warn' or 'fail'.
+    """
+    if len(checks) == 0:
+        return []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(check) for _, check in checks]
+    results = []
+    for (description, _), future in zip(checks, futures):
+        try:
+            message = future.result()
+            status = 'ok'
+        except PreflightWarning as e:
+            status, message = 'warn', str(e)
+        except Exception as e:
+            status, message = 'fail', str(e) or type(e).__name__
+        results.append((description, status, message or ''))
+    return results
+
+
+def check_all(checks, max_workers=8):
+    """Run pre-flight checks, print a combined report and raise
+    JhubctlError if any of them failed.
+    """
+    results = run_checks(checks, max_workers=max_workers)
+    print("Pre-flight checks:")
+    for description, status, message in results:
+        line = f"  [{status:>4}] {description}"
+        if message:
+            line += f": {message}"
+        print(line)
+    failed = [r for r in results if r[1] == 'fail']
+    if failed:
+        raise JhubctlError(
+            f"{len(failed)} pre-flight check(s) failed; nothing was created.")
+    return results
@@ -0,0 +1,344 @@
+import sys
+import hmac
+import json
+import time
+import uuid
+import secrets
+import threading
+import http.server
+import urllib.parse
+import concurrent.futures
+
+from traitlets.config import Configurable
+from traitlets import Unicode, Integer, List, default
+
+from .utils import JhubctlError, ThreadOutput
+from .store import Store
+from .clusters import ClusterList
+from .hubs import HubList
+
+
+class NotFound(Exception):
+    """The requested route, resource, action or job does not exist."""
+
+
+class Job(object):
+    """A long running action (create/delete) queued on the server."""
+    def __init__(self, resource, action, name, context=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.resource = resource
+        self.action = action
+        self.name = name
+        self.context = context
+        self.status = 'queued'
+        self.output = ''
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'resource': self.resource,
+            'action': self.action,
+            'name': self.name,
+            'context': self.context,
+            'status': self.status,
+            'output': self.output,
+            'error': self.error,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+
+class JhubctlServer(Configurable):
+    """Long-running jhubctl exposing its actions over a local HTTP API.
+
+    Clients, template environments, the kubeconfig parse and the
+    local state stay warm between requests. Create and delete run as
+    jobs on a queue and are polled through `/api/jobs/<id>`.
+
+    Every request must send `Authorization: token <token>`. Requests
+    whose Host is not the server's address, or that come from another
+    origin (e.g. a web page the operator visits), are rejected.
+
+    Routes:
+
+        GET    /api/clusters
+        GET    /api/hubs[?context=<context>&all_clusters=1&refresh=1]
+        GET    /api/<resource>s/<name>[?context=<context>&refresh=1]
+        GET    /api/<resource>s/<name>/describe[?context=<context>]
+        POST   /api/<resource>s/<name>[?context=<context>]
+        DELETE /api/<resource>s/<name>[?context=<context>]
+        GET    /api/jobs
+        GET    /api/jobs/<id>
+    """
+    ip = Unicode(
+        u'127.0.0.1',
+        help="IP address the server listens on."
+    ).tag(config=True)
+
+    port = Integer(
+        8765,
+        help="Port the server listens on."
+    ).tag(config=True)
+
+    max_jobs = Integer(
+        4,
+        help="Number of create/delete jobs to run concurrently."
+    ).tag(config=True)
+
+    token = Unicode(
+        help="Token clients send as `Authorization: token <token>`. "
+             "Generated (and printed) at startup if not given."
+    ).tag(config=True)
+
+    @default('token')
+    def _default_token(self):
+        return secrets.token_hex(32)
+
+    allowed_hosts = List(
+        Unicode(),
+        help="Host headers accepted besides '<ip>:<port>' and "
+             "'localhost:<port>', e.g. behind a port forward."
+    ).tag(config=True)
+
+    # Default kubeconfig context for hub actions.
+    context = Unicode(
+        help="Kubeconfig context of the cluster to manage."
+    )
+
+    def __init__(self, kubeconf, store, **traits):
+        self.kubeconf = kubeconf
+        self.store = store
+        super().__init__(**traits)
+        self.jobs = {}
+        self._jobs_lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_jobs
+        )
+        self.output = ThreadOutput(sys.stdout)
+
+    def get_resource_list(self, resource, context=None, refresh=False):
+        """Get the ClusterList or HubList serving a request."""
+        store = self.store
+        if refresh:
+            store = Store(config=self.config, refresh=True)
+        if resource == 'cluster':
+            return ClusterList(
+                kubeconf=self.kubeconf,
+                store=store,
+                config=self.config
+            )
+        if resource == 'hub':
+            return HubList(
+                kubeconf=self.kubeconf,
+                store=store,
+                context=context or self.context,
+                config=self.config
+            )
+        raise NotFound(f"resource {resource}")
+
+    def get_action(self, resource_list, action):
+        """Get a resource action, e.g. `HubList.create`."""
+        method = getattr(resource_list, action, None)
+        if method is None:
+            raise NotFound(f"action {action}")
+        return method
+
+    def run_action(self, resource, action, name, context=None, refresh=False):
+        """Run a resource action and return what it printed."""
+        resource_list = self.get_resource_list(resource, context, refresh)
+        method = self.get_action(resource_list, action)
+        with self.output.capture() as buffer:
+            method(name)
+        return buffer.getvalue()
+
+    def submit(self, resource, action, name, context=None):
+        """Queue a long running action."""
+        # Resolve the resource now so bad requests fail immediately.
+        resource_list = self.get_resource_list(resource, context)
+        method = self.get_action(resource_list, action)
+        job = Job(resource, action, name, context=context)
+        with self._jobs_lock:
+            self.jobs[job.id] = job
+        self._executor.submit(self._run_job, job, method)
+        return job
+
+    def _run_job(self, job, method):
+        job.status = 'running'
+        job.started = time.time()
+        with self.output.capture() as buffer:
+            try:
+                result = method(job.name)
+            except Exception as e:
+                job.error = f'{type(e).__name__}: {e}'
+                job.status = 'failed'
+            else:
+                job.status = 'failed' if result is False else 'succeeded'
+        job.output = buffer.getvalue()
+        job.finished = time.time()
+
+    def get_job(self, job_id):
+        try:
+            return self.jobs[job_id]
+        except KeyError:
+            raise NotFound(f"job {job_id}")
+
+    def get_hosts(self):
+        """Host headers the server answers to."""
+        hosts = [f'{self.ip}:{self.port}', f'localhost:{self.port}']
+        return hosts + list(self.allowed_hosts)
+
+    def check_request(self, headers):
+        """Check a request's Host, Origin and token.
+
+        Returns
+        -------
+        status : int or None
+            Error status to answer with, or None if the request is allowed.
+        message : str
+        """
+        hosts = self.get_hosts()
+        # Guards against DNS rebinding: the page's own name is the Host.
+        if headers.get('Host') not in hosts:
+            return 403, f"Host {headers.get('Host')} is not allowed."
+        origin = headers.get('Origin')
+        if origin is not None and origin not in [f'http://{host}' for host in hosts]:
+            return 403, f"Origin {origin} is not allowed."
+        scheme, _, token = (headers.get('Authorization') or '').partition(' ')
+        if scheme.lower() != 'token' or not hmac.compare_digest(token, self.token):
+            return 401, "Missing or wrong token; send 'Authorization: token <token>'."
+        return None, ''
+
+    def list_clusters(self):
+        """Clusters in kubeconfig, with what the store knows of them."""
+        self.kubeconf.open()
+        try:
+            names = [c['name'] for c in self.kubeconf.get_clusters()]
+        finally:
+            self.kubeconf.release()
+        records = self.store.get_clusters()
+        return [
+            dict(records.get(name, {}), cluster_name=name)
+            for name in names
+        ]
+
+    def list_hubs(self, context=None, all_clusters=False, refresh=False):
+        """Hubs per context, answered from the store when possible."""
+        hub_list = self.get_resource_list('hub', context, refresh)
+        if all_clusters:
+            contexts = hub_list.get_contexts()
+        else:
+            contexts = [hub_list.context]
+        listings = {}
+        for context, (hubs, updated) in hub_list.get_listings(contexts).items():
+            if isinstance(hubs, Exception):
+                listings[context] = {'error': str(hubs)}
+            else:
+                listings[context] = {
+                    'hubs': hubs,
+                    'updated': updated,
+                    'stale': hub_list.store.is_stale(updated)
+                }
+        return listings
+
+    def start(self):
+        """Serve the API until interrupted."""
+        sys.stdout = self.output
+        httpd = http.server.ThreadingHTTPServer(
+            (self.ip, self.port),
+            RequestHandler
+        )
+        httpd.jhubctl = self
+        print(f"Serving jhubctl on http://{self.ip}:{self.port}/api")
+        print(f"Token: {self.token}")
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            httpd.server_close()
+            self._executor.shutdown(wait=False)
+            sys.stdout = self.output.stream
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    """Routes HTTP requests to a JhubctlServer."""
+
+    def _send(self, status, data):
+        body = json.dumps(data, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self, method):
+        url = urllib.parse.urlparse(self.path)
+        parts = [p for p in url.path.split('/') if p]
+        query = dict(urllib.parse.parse_qsl(url.query))
+        context = query.get('context')
+        refresh = query.get('refresh') in ('1', 'true')
+        server = self.server.jhubctl
+
+        if parts[:1] != ['api']:
+            raise NotFound(url.path)
+        parts = parts[1:]
+
+        if parts == ['jobs'] and method == 'GET':
+            return 200, [job.to_dict() for job in server.jobs.values()]
+        if len(parts) == 2 and parts[0] == 'jobs' and method == 'GET':
+            return 200, server.get_job(parts[1]).to_dict()
+
+        if parts == ['clusters'] and method == 'GET':
+            return 200, server.list_clusters()
+        if parts == ['hubs'] and method == 'GET':
+            all_clusters = query.get('all_clusters') in ('1', 'true')
+            return 200, server.list_hubs(context, all_clusters, refresh)
+
+        if len(parts) in (2, 3) and parts[0] in ('clusters', 'hubs'):
+            resource, name = parts[0][:-1], parts[1]
+            if len(parts) == 3:
+                if parts[2] != 'describe' or method != 'GET':
+                    raise NotFound(url.path)
+                output = server.run_action(resource, 'describe', name, context)
+                return 200, {'output': output}
+            if method == 'GET':
+                output = server.run_action(resource, 'get', name, context, refresh)
+                return 200, {'output': output}
+            if method in ('POST', 'DELETE'):
+                action = 'create' if method == 'POST' else 'delete'
+                job = server.submit(resource, action, name, context)
+                return 202, job.to_dict()
+
+        raise NotFound(url.path)
+
+    def _handle(self, method):
+        status, message = self.server.jhubctl.check_request(self.headers)
+        if status is not None:
+            self._send(status, {'error': message})
+            return
+        try:
+            status, data = self._route(method)
+        except NotFound as e:
+            status, data = 404, {'error': f'Not found: {e}'}
+        except JhubctlError as e:
+            status, data = 400, {'error': str(e)}
+        except Exception as e:
+            status, data = 500, {'error': f'{type(e).__name__}: {e}'}
+        self._send(status, data)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def log_message(self, format, *args):
+        sys.stderr.write(f"[jhubctl] {self.address_string()} {format % args}\n")
@@ -0,0 +1,263 @@
+import sys
+import time
+import sqlite3
+import pathlib
+import threading
+import subprocess
+
+from traitlets.config import Configurable
+from traitlets import (
+    Unicode,
+    Float,
+    Bool,
+    default
+)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS clusters (
+    name TEXT PRIMARY KEY,
+    cluster_name TEXT,
+    provider TEXT,
+    endpoint TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS clusters_by_cluster_name ON clusters (cluster_name);
+
+CREATE TABLE IF NOT EXISTS stacks (
+    cluster TEXT,
+    name TEXT,
+    status TEXT,
+    updated REAL,
+    PRIMARY KEY (cluster, name)
+);
+
+CREATE TABLE IF NOT EXISTS hubs (
+    context TEXT,
+    name TEXT,
+    namespace TEXT,
+    url TEXT,
+    chart_version TEXT,
+    updated REAL,
+    PRIMARY KEY (context, name)
+);
+CREATE INDEX IF NOT EXISTS hubs_by_name ON hubs (name);
+
+CREATE TABLE IF NOT EXISTS refreshes (
+    key TEXT PRIMARY KEY,
+    started REAL
+);
+"""
+
+
+def format_age(seconds):
+    """Format a number of seconds as a short human readable age."""
+    seconds = int(seconds)
+    if seconds < 60:
+        return f'{seconds}s'
+    if seconds < 3600:
+        return f'{seconds // 60}m'
+    if seconds < 86400:
+        return f'{seconds // 3600}h'
+    return f'{seconds // 86400}d'
+
+
+class Store(Configurable):
+    """Local inventory of clusters, stacks and hubs.
+
+    `get` commands answer from this SQLite database instead of
+    querying helm, kubectl and AWS on every call. Entries are
+    refreshed with `--refresh`, by create/delete, or by a
+    background refresh once they are older than `max_age`.
+    """
+    path = Unicode(
+        help="Path to the local state database."
+    ).tag(config=True)
+
+    @default('path')
+    def _default_path(self):
+        return str(pathlib.Path.home().joinpath('.jhubctl', 'state.db'))
+
+    max_age = Float(
+        300.0,
+        help="Seconds after which stored entries are reported as stale."
+    ).tag(config=True)
+
+    refresh = Bool(
+        False,
+        help="Query clusters directly and update the local state."
+    ).tag(config=True)
+
+    background_refresh = Bool(
+        True,
+        help="Refresh stale entries in a background process."
+    ).tag(config=True)
+
+    def __init__(self, **traits):
+        super().__init__(**traits)
+        self._lock = threading.Lock()
+        self._connection = None
+
+    @property
+    def connection(self):
+        """Open (and create, if needed) the state database."""
+        if self._connection is None:
+            path = pathlib.Path(self.path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(
+                str(path),
+                timeout=30,
+                check_same_thread=False
+            )
+            self._connection.row_factory = sqlite3.Row
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def _execute(self, *statements):
+        """Run (sql, parameters) statements in a single transaction."""
+        with self._lock, self.connection as connection:
+            for sql, parameters in statements:
+                connection.execute(sql, parameters)
+
+    def _query(self, sql, parameters=()):
+        with self._lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def is_stale(self, updated):
+        """Check if an entry updated at the given time is stale."""
+        return updated is None or time.time() - updated > self.max_age
+
+    # --------------- Clusters ------------------
+
+    def put_cluster(self, name, cluster_name, provider, endpoint=None, stacks=None):
+        """Store a cluster and (optionally) the status of its stacks."""
+        now = time.time()
+        statements = [(
+            "INSERT OR REPLACE INTO clusters VALUES (?, ?, ?, ?, ?)",
+            (name, cluster_name, provider, endpoint, now)
+        )]
+        if stacks is not None:
+            statements.append(("DELETE FROM stacks WHERE cluster = ?", (name,)))
+            for stack, status in stacks.items():
+                statements.append((
+                    "INSERT INTO stacks VALUES (?, ?, ?, ?)",
+                    (name, stack, status, now)
+                ))
+        self._execute(*statements)
+
+    def delete_cluster(self, name):
+        """Remove a cluster and its stacks."""
+        self._execute(
+            ("DELETE FROM clusters WHERE name = ?", (name,)),
+            ("DELETE FROM stacks WHERE cluster = ?", (name,)),
+        )
+
+    def get_cluster(self, cluster_name):
+        """Get a stored cluster by its kubeconfig cluster name."""
+        rows = self._query(
+            "SELECT * FROM clusters WHERE cluster_name = ?", (cluster_name,))
+        if len(rows) == 0:
+            return None
+        return dict(rows[0])
+
+    def get_clusters(self):
+        """Get all stored clusters, keyed by kubeconfig cluster name."""
+        rows = self._query("SELECT * FROM clusters")
+        return {row['cluster_name']: dict(row) for row in rows}
+
+    def get_stacks(self, name):
+        """Get the stored stacks of a cluster."""
+        rows = self._query(
+            "SELECT name, status, updated FROM stacks WHERE cluster = ?",
+            (name,))
+        return [dict(row) for row in rows]
+
+    # --------------- Hubs ------------------
+
+    def put_hubs(self, context, hubs):
+        """Replace all hubs stored for a context.
+
+        Parameters
+        ----------
+        context : str
+            Kubeconfig context the hubs were listed from.
+        hubs : list of dict
+            Hubs with `name`, `namespace`, `url` and `chart_version` keys.
+        """
+        now = time.time()
+        statements = [("DELETE FROM hubs WHERE context = ?", (context,))]
+        for hub in hubs:
+            statements.append((
+                "INSERT INTO hubs VALUES (?, ?, ?, ?, ?, ?)",
+                (context, hub['name'], hub.get('namespace'), hub.get('url'),
+                 hub.get('chart_version'), now)
+            ))
+        # Remember that this context was listed, even if it has no hubs.
+        statements.append((
+            "INSERT OR REPLACE INTO refreshes VALUES (?, ?)",
+            (f'hubs:{context}:listed', now)
+        ))
+        self._execute(*statements)
+
+    def put_hub(self, context, name, namespace=None, url=None, chart_version=None):
+        """Store (or update) a single hub."""
+        self._execute((
+            "INSERT OR REPLACE INTO hubs VALUES (?, ?, ?, ?, ?, ?)",
+            (context, name, namespace, url, chart_version, time.time())
+        ))
+
+    def delete_hub(self, context, name):
+        """Remove a hub."""
+        self._execute((
+            "DELETE FROM hubs WHERE context = ? AND name = ?",
+            (context, name)
+        ))
+
+    def get_hubs(self, context):
+        """Get the hubs stored for a context.
+
+        Returns
+        -------
+        hubs : list of dict or None
+            Stored hubs, or None if this context was never listed.
+        updated : float
+            Time the context was last listed.
+        """
+        listed = self._query(
+            "SELECT started FROM refreshes WHERE key = ?",
+            (f'hubs:{context}:listed',))
+        if len(listed) == 0:
+            return None, None
+        rows = self._query(
+            "SELECT name, namespace, url, chart_version FROM hubs "
+            "WHERE context = ? ORDER BY name", (context,))
+        return [dict(row) for row in rows], listed[0]['started']
+
+    # --------------- Background refresh ------------------
+
+    def spawn_refresh(self, *args):
+        """Run `jhubctl <args> --refresh` in a detached process.
+
+        A refresh for the same arguments is started at most once
+        every `max_age` seconds.
+        """
+        if self.background_refresh is False:
+            return
+        key = 'spawn:' + ' '.join(args)
+        now = time.time()
+        with self._lock, self.connection as connection:
+            row = connection.execute(
+                "SELECT started FROM refreshes WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row['started'] < self.max_age:
+                return
+            connection.execute(
+                "INSERT OR REPLACE INTO refreshes VALUES (?, ?)", (key, now))
+        subprocess.Popen(
+            [sys.executable, '-m', 'jhubctl.main'] + list(args) +
+            ['--refresh', f'--Store.path={self.path}'],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True
+        )
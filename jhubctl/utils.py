@@ -1,10 +1,18 @@
+import io
 import sys
 import jinja2
+import threading
+import contextlib
+import functools
 import pathlib
 import subprocess
 from ruamel import yaml
 from ruamel.yaml.compat import StringIO
 
+# Node label naming the pool a node belongs to.
+NODE_POOL_LABEL = 'jhubctl/node-pool'
+
+
 class SubclassError(Exception):
     """Must be implemented in a subclass."""
 
@@ -12,6 +20,37 @@ class JhubctlError(Exception):
     """CLI exceptions"""
 
 
+class ThreadOutput(io.TextIOBase):
+    """Stand-in for stdout that can capture the prints of a single thread.
+
+    Resource actions report through `print`; the server and rolling
+    upgrades run many of them at once, so each capture is kept local
+    to its thread.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self._local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None:
+            return self.stream.write(text)
+        return buffer.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    @contextlib.contextmanager
+    def capture(self):
+        """Capture everything printed by this thread."""
+        buffer = io.StringIO()
+        self._local.buffer = buffer
+        try:
+            yield buffer
+        finally:
+            self._local.buffer = None
+
+
 def get_flag_args(**options):
     """Build a list of flags."""
     flags = []
@@ -26,10 +65,19 @@ def get_flag_args(**options):
     return flags
 
 
-def kubectl(*args, input=None, **flags):
-    """Simple wrapper to kubectl."""
+def kubectl(*args, input=None, timeout=None, context=None, kubeconfig=None, **flags):
+    """Simple wrapper to kubectl.
+
+    If given, `context` and `kubeconfig` are passed through as
+    `--context` and `--kubeconfig` so the call does not depend
+    on the current-context stored in kubeconfig.
+    """
     # Build command line call.
     line = ['kubectl'] + list(args)
+    if context:
+        flags['context'] = context
+    if kubeconfig:
+        flags['kubeconfig'] = str(kubeconfig)
     line = line + get_flag_args(**flags)
     if input is not None:
         line = line + ['-f', '-']
@@ -38,15 +86,24 @@ def kubectl(*args, input=None, **flags):
         line,
         input=input,
         capture_output=True,
-        text=True
+        text=True,
+        timeout=timeout
     )
     return output
 
 
-def helm(*args, input=None, **flags):
-    """Simple wrapper to helm."""
+def helm(*args, input=None, timeout=None, context=None, kubeconfig=None, **flags):
+    """Simple wrapper to helm.
+
+    If given, `context` and `kubeconfig` are passed through as
+    `--kube-context` and `--kubeconfig`.
+    """
     # Build command line call.
     line = ['helm'] + list(args)
+    if context:
+        flags['kube-context'] = context
+    if kubeconfig:
+        flags['kubeconfig'] = str(kubeconfig)
     line = line + get_flag_args(**flags)
     if input is not None:
         line = line + ['-f', '-']
@@ -55,11 +112,26 @@ def helm(*args, input=None, **flags):
         line,
         input=input,
         capture_output=True,
-        text=True
+        text=True,
+        timeout=timeout
     )
     return output
 
 
+def merge_config(base, update):
+    """Recursively merge the `update` dictionary into `base`.
+
+    Nested dictionaries are merged key by key instead of
+    replaced. Returns `base`.
+    """
+    for key, value in update.items():
+        if isinstance(value, dict) and isinstance(base.get(key), dict):
+            merge_config(base[key], value)
+        else:
+            base[key] = value
+    return base
+
+
 def sanitize_path(path):
     if isinstance(path, str):
         path = pathlib.Path(path).resolve()
@@ -70,6 +142,17 @@ def sanitize_path(path):
     return path
 
 
+@functools.lru_cache(maxsize=None)
+def get_template_env(template_dir):
+    """Get a jinja2 environment for a template directory.
+
+    Environments are cached, so each template is compiled once
+    per process (and recompiled if the file changes).
+    """
+    template_loader = jinja2.FileSystemLoader(searchpath=template_dir)
+    return jinja2.Environment(loader=template_loader)
+
+
 def get_template(template_path, **parameters):
     """Use jinja2 to fill in template with given parameters.
     
@@ -92,8 +175,7 @@ def get_template(template_path, **parameters):
     template_dir = str(path.parent)
 
     ## Apply ARN of instance role of worker nodes and apply to cluster
-    template_loader = jinja2.FileSystemLoader(searchpath=template_dir)
-    template_env = jinja2.Environment(loader=template_loader)
+    template_env = get_template_env(template_dir)
 
     template = template_env.get_template(template_file)
     output_text = template.render(**parameters)
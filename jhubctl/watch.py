@@ -0,0 +1,150 @@
+import sys
+import json
+import time
+import queue
+import shutil
+import threading
+import subprocess
+
+from traitlets.config import Configurable
+from traitlets import Bool, Float
+
+from .utils import get_flag_args, JhubctlError
+
+
+class Watch(Configurable):
+    """Options of `get --watch`."""
+    enabled = Bool(
+        False,
+        help="Keep listing, redrawing the rows that change."
+    ).tag(config=True)
+
+    poll_interval = Float(
+        15.0,
+        help="Seconds between polls of what cannot be watched, "
+             "e.g. CloudFormation stacks and kubeconfig."
+    ).tag(config=True)
+
+
+class RowDisplay(object):
+    """Print rows keyed by name, then rewrite only the rows that change.
+
+    On a terminal, changed rows are redrawn in place. Otherwise, each
+    change is printed as a new line.
+    """
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self.tty = self.stream.isatty()
+        self.keys = []
+        self.rows = {}
+
+    def update(self, key, text):
+        if self.rows.get(key) == text:
+            return
+        if self.tty:
+            text = text[:shutil.get_terminal_size().columns - 1]
+        if key in self.rows and self.tty:
+            up = len(self.keys) - self.keys.index(key)
+            self.stream.write(f'\x1b[{up}A\r\x1b[2K{text}\x1b[{up}B\r')
+        else:
+            if key not in self.rows:
+                self.keys.append(key)
+            self.stream.write(text + '\n')
+        self.stream.flush()
+        self.rows[key] = text
+
+
+class KubeWatch(object):
+    """Stream changes to Kubernetes objects from `kubectl get --watch`.
+
+    kubectl watches a single resource type per call, so one process
+    is started per resource; their events are merged in one queue.
+
+    Parameters
+    ----------
+    resources : list of str
+        Resource types to watch, e.g. ['pods', 'services'].
+    namespace : str
+        Namespace of the objects. If None, watch all namespaces.
+    selector : str
+        Label selector the objects must match.
+    """
+    def __init__(self, resources, namespace=None, selector=None, context=None, kubeconfig=None):
+        self.resources = resources
+        self.namespace = namespace
+        self.flags = {}
+        if namespace is not None:
+            self.flags['namespace'] = namespace
+        if selector:
+            self.flags['selector'] = selector
+        if context:
+            self.flags['context'] = context
+        if kubeconfig:
+            self.flags['kubeconfig'] = str(kubeconfig)
+        self.processes = []
+        self.queue = queue.Queue()
+
+    def start(self):
+        for resource in self.resources:
+            line = [
+                'kubectl', 'get', resource, '--watch',
+                '--output', 'json', '--output-watch-events'
+            ] + get_flag_args(**self.flags)
+            if self.namespace is None:
+                line.append('--all-namespaces')
+            process = subprocess.Popen(
+                line,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True
+            )
+            self.processes.append(process)
+            thread = threading.Thread(
+                target=self._read,
+                args=(resource, process),
+                daemon=True
+            )
+            thread.start()
+
+    def _read(self, resource, process):
+        """Decode the stream of JSON documents kubectl prints."""
+        decoder = json.JSONDecoder()
+        buffer = ''
+        for line in process.stdout:
+            buffer += line
+            while True:
+                buffer = buffer.lstrip()
+                try:
+                    event, end = decoder.raw_decode(buffer)
+                except ValueError:
+                    break
+                buffer = buffer[end:]
+                self.queue.put((resource, event['type'], event['object']))
+        process.wait()
+        self.queue.put((resource, None, process.stderr.read()))
+
+    def events(self, timeout=None):
+        """Yield (resource, event type, object) tuples until `timeout`
+        seconds have passed, or forever if no timeout is given.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return
+            try:
+                resource, event_type, obj = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                return
+            # The kubectl process ended.
+            if event_type is None:
+                raise JhubctlError(f"Stopped watching {resource}: {obj}")
+            yield resource, event_type, obj
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.wait()
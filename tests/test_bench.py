@@ -0,0 +1,77 @@
+import random
+
+import pytest
+
+from jhubctl.bench import FakeHub, HubBench, percentile
+
+TOKEN = 'test-token'
+
+
+@pytest.fixture
+def fake_hub(request):
+    hub = FakeHub(TOKEN, spawn_time=0.05, failure_rate=request.param)
+    hub.start()
+    yield hub
+    hub.stop()
+
+
+def make_bench(users):
+    return HubBench(users=users, concurrency=10, api_token=TOKEN, poll_interval=0.01)
+
+
+def expected_failures(seed, users, failure_rate):
+    """Replay the fake hub's draws: one spawn delay, then one failure
+    draw, per spawn.
+    """
+    rng = random.Random(seed)
+    failed = 0
+    for _ in range(users):
+        rng.uniform(0.5, 1.5)
+        failed += rng.random() < failure_rate
+    return failed
+
+
+@pytest.mark.parametrize('fake_hub, failed', [(0.0, 0), (1.0, 20)], indirect=['fake_hub'])
+def test_run_counts(fake_hub, failed):
+    times, failures, duration, cleanup_failures = make_bench(20).run(fake_hub.url)
+    assert len(times) == 20 - failed
+    assert failures == ({'Spawn failed': failed} if failed else {})
+    assert times == sorted(times)
+    assert cleanup_failures == {}
+    assert fake_hub.users == {}
+
+
+@pytest.mark.parametrize('fake_hub', [0.25], indirect=True)
+def test_run_fixed_failure_rate(fake_hub):
+    random.seed(1)
+    times, failures, duration, cleanup_failures = make_bench(40).run(fake_hub.url)
+    failed = expected_failures(1, 40, 0.25)
+    assert 0 < failed < 40
+    assert failures == {'Spawn failed': failed}
+    assert len(times) == 40 - failed
+    assert cleanup_failures == {}
+    assert fake_hub.users == {}
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert [percentile(values, p) for p in (50, 90, 95, 99)] == [50, 90, 95, 99]
+    assert percentile([3.0], 99) == 3.0
+    assert percentile([], 50) is None
+
+
+def test_print_report(capsys):
+    bench = make_bench(4)
+    times = [1.0, 2.0, 3.0]
+    bench.print_report(times, {'Spawn failed': 1}, 6.0)
+    assert capsys.readouterr().out.splitlines() == [
+        "Spawned 3/4 servers in 6.0s (30.0 spawns/min)",
+        "Spawn time:",
+        "  p50: 2.0s",
+        "  p90: 3.0s",
+        "  p95: 3.0s",
+        "  p99: 3.0s",
+        "  max: 3.0s",
+        "Failures:",
+        "  1 x Spawn failed",
+    ]
@@ -0,0 +1,99 @@
+import pytest
+
+from jhubctl.capacity import (
+    CapacityPlanner,
+    get_users_per_node,
+    parse_cpu,
+    parse_memory,
+)
+from jhubctl.utils import JhubctlError
+
+GI = 2**30
+
+
+def make_group(pool, cpu, memory, pods=30, min_size=0, max_size=1):
+    return dict(
+        pool=pool,
+        instance_types=['t3.medium'],
+        min_size=min_size,
+        max_size=max_size,
+        on_demand=max_size,
+        free=dict(cpu=cpu, memory=memory, pods=pods)
+    )
+
+
+def make_guarantee(pool='', cpu=0.0, memory=1 * GI):
+    return dict(pool=pool, cpu=cpu, memory=memory)
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('512Mi', 512 * 2**20),
+    ('1G', GI),
+    ('1Gi', GI),
+    ('2048', 2048),
+    (2 * GI, 2 * GI),
+])
+def test_parse_memory(value, expected):
+    assert parse_memory(value) == expected
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('500m', 0.5),
+    (0.25, 0.25),
+    ('2', 2.0),
+])
+def test_parse_cpu(value, expected):
+    assert parse_cpu(value) == expected
+
+
+def test_parse_errors():
+    with pytest.raises(JhubctlError):
+        parse_memory('lots')
+    with pytest.raises(JhubctlError):
+        parse_cpu('fast')
+
+
+@pytest.mark.parametrize('guarantee, expected', [
+    # 4 users fit by memory, 8 by CPU.
+    (make_guarantee(cpu=0.5, memory=1 * GI), (4, 'memory')),
+    # 2 users fit by CPU, 8 by memory.
+    (make_guarantee(cpu=2.0, memory=0.5 * GI), (2, 'cpu')),
+    # Without guarantees, only the pod limit applies.
+    (make_guarantee(cpu=0.0, memory=0), (10, 'pods')),
+])
+def test_users_per_node_limiting_resource(guarantee, expected):
+    free = dict(cpu=4.0, memory=4 * GI, pods=10)
+    assert get_users_per_node(free, guarantee) == expected
+
+
+def test_pack_pinned_to_pool():
+    planner = CapacityPlanner(users=5)
+    groups = [
+        make_group('on-demand', cpu=4.0, memory=8 * GI, max_size=3),
+        make_group('spot', cpu=2.0, memory=2 * GI, max_size=3),
+    ]
+    nodes, unplaced = planner.pack(groups, [make_guarantee(pool='spot')])
+    assert unplaced == 0
+    # Two users per spot node; nothing lands on the on-demand group.
+    assert [n['group'] for n in nodes] == [1, 1, 1]
+    assert [n['users'] for n in nodes] == [2, 2, 1]
+
+
+def test_pack_unplaced_when_max_size_exhausted():
+    planner = CapacityPlanner(users=10)
+    groups = [
+        make_group('on-demand', cpu=4.0, memory=8 * GI, max_size=3),
+        make_group('spot', cpu=2.0, memory=2 * GI, max_size=2),
+    ]
+    nodes, unplaced = planner.pack(groups, [make_guarantee(pool='spot')])
+    assert len(nodes) == 2
+    assert sum(n['users'] for n in nodes) == 4
+    assert unplaced == 6
+
+
+def test_pack_keeps_min_size_nodes():
+    planner = CapacityPlanner(users=1)
+    groups = [make_group('spot', cpu=2.0, memory=2 * GI, min_size=2, max_size=3)]
+    nodes, unplaced = planner.pack(groups, [make_guarantee()])
+    assert unplaced == 0
+    assert [n['users'] for n in nodes] == [1, 0]